@@ -0,0 +1,187 @@
+import sys
+import os
+import multiprocessing
+import re
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+from backend.ebml import EBMLError, MKVInfo, read_info
+from backend.mkvtoolnix import _get_mkvmerge_info
+from backend.probe import get_probe_cache
+
+VIDEO_SUFFIXES = (".mkv",)
+
+# Probes running at the same time on local disks and on network filesystems
+# Network shares are mostly waiting on the server, and more readers only make it seek more
+LOCAL_WORKERS = os.cpu_count() or 4
+NETWORK_WORKERS = 2
+
+# Filesystem types in /proc/mounts that are served over the network
+NETWORK_FILESYSTEMS = {
+    "9p",
+    "afs",
+    "ceph",
+    "cifs",
+    "davfs",
+    "fuse.rclone",
+    "fuse.sshfs",
+    "glusterfs",
+    "fuse.glusterfs",
+    "lustre",
+    "ncpfs",
+    "nfs",
+    "nfs4",
+    "smb3",
+    "smbfs",
+    "sshfs",
+}
+
+
+def read_mounts(path: Path = Path("/proc/mounts")) -> list[tuple[str, str]]:
+    """
+    Get the (mount point, filesystem type) of every mount, longest mount point first.
+
+    Returns an empty list where /proc/mounts does not exist, so everything counts as local.
+    """
+    mounts = []
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # Spaces and other special characters are escaped as octal
+                mount_point = re.sub(
+                    r"\\([0-7]{3})", lambda match: chr(int(match[1], 8)), fields[1]
+                )
+                mounts += [(mount_point, fields[2])]
+    except OSError:
+        return []
+    return sorted(mounts, key=lambda mount: len(mount[0]), reverse=True)
+
+
+def is_network_path(video: Path, mounts: list[tuple[str, str]]) -> bool:
+    """Check if a path is on a network filesystem, given the mounts from read_mounts()."""
+    path = Path(video).absolute().as_posix()
+    for mount_point, filesystem in mounts:
+        if path == mount_point or path.startswith(mount_point.rstrip("/") + "/"):
+            return filesystem in NETWORK_FILESYSTEMS
+    return False
+
+
+def find_videos(root: Path, suffixes=VIDEO_SUFFIXES) -> list[Path]:
+    """Find every video under root, in a stable order."""
+    return sorted(
+        path
+        for path in Path(root).rglob("*")
+        if path.suffix.lower() in suffixes and path.is_file()
+    )
+
+
+def _probe_file(video: Path) -> MKVInfo | None:
+    """
+    Probe a single file in a worker process. Results are cached by the parent.
+
+    Returns None if the file could not be probed.
+    """
+    try:
+        return read_info(video)
+    except EBMLError:
+        return _get_mkvmerge_info(video)
+
+
+class BulkProbe:
+    """
+    Probe the title, duration and tracks of many videos on a bounded process pool.
+
+    Videos whose probe is cached and unchanged are answered first without starting any process.
+    The rest are probed with at most local_workers probes running on local disks
+    and network_workers on network filesystems, so a NAS is not thrashed.
+    New results are stored in the probe cache.
+    """
+
+    def __init__(
+        self,
+        videos: list[Path],
+        local_workers: int = LOCAL_WORKERS,
+        network_workers: int = NETWORK_WORKERS,
+    ) -> None:
+        self.videos = [Path(video) for video in videos]
+        self.limits = {False: local_workers, True: network_workers}
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """Stop starting new probes. Probes already running are abandoned."""
+        self._cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def run(self):
+        """
+        Yield (video, info) as each probe finishes, in no particular order.
+
+        info is None for videos that could not be probed.
+        """
+        cache = get_probe_cache()
+        mounts = read_mounts()
+
+        # Videos that still need a probe, split by local disks and network filesystems
+        queues = {False: deque(), True: deque()}
+        for video in self.videos:
+            if self.is_cancelled():
+                return
+            try:
+                stat = os.stat(video)
+            except OSError:
+                yield video, None
+                continue
+            info = cache.get(video, stat)
+            if info:
+                yield video, info
+            else:
+                queues[is_network_path(video, mounts)] += [(video, stat)]
+
+        if not queues[False] and not queues[True]:
+            return
+
+        workers = sum(
+            min(limit, len(queues[network])) for network, limit in self.limits.items()
+        )
+        # Spawned workers do not inherit the Qt threads of the parent
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        running = {}
+        in_flight = {False: 0, True: 0}
+        try:
+            while not self.is_cancelled():
+                for network, queue in queues.items():
+                    while queue and in_flight[network] < self.limits[network]:
+                        video, stat = queue.popleft()
+                        future = executor.submit(_probe_file, video)
+                        running[future] = (video, stat, network)
+                        in_flight[network] += 1
+
+                if not running:
+                    break
+
+                done, _ = wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    video, stat, network = running.pop(future)
+                    in_flight[network] -= 1
+                    try:
+                        info = future.result()
+                    except Exception as error:
+                        print(f"Probe of {video} failed: {error}")
+                        yield video, None
+                        continue
+                    # Failed probes are not cached, so they are tried again next time
+                    if info is not None:
+                        cache.set(video, info, stat)
+                    yield video, info
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
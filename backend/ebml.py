@@ -0,0 +1,468 @@
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# Bytes mapped from the start of the file
+# Muxers write Info and Tracks right after the SeekHead, well inside this
+HEAD_SIZE = 1024 * 1024
+
+# Element ids, including their length marker bits
+EBML = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TITLE = 0x7BA9
+MUXING_APP = 0x4D80
+WRITING_APP = 0x5741
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+NAME = 0x536E
+LANGUAGE = 0x22B59C
+LANGUAGE_IETF = 0x22B59D
+FLAG_DEFAULT = 0x88
+FLAG_FORCED = 0x55AA
+CLUSTER = 0x1F43B675
+VOID = 0xEC
+CRC32 = 0xBF
+
+DOC_TYPES = ("matroska", "webm")
+
+TRACK_TYPES = {
+    1: "video",
+    2: "audio",
+    3: "complex",
+    16: "logo",
+    17: "subtitles",
+    18: "buttons",
+    32: "control",
+    33: "metadata",
+}
+
+# Size of an element whose size is not known, e.g. a Segment that is still being written
+UNKNOWN_SIZE = -1
+
+
+class EBMLError(Exception):
+    """Raised for files that are not Matroska or can not be read without mkvmerge."""
+
+
+@dataclass
+class Track:
+    number: int = -1
+    type: str = ""
+    codec: str = ""
+    name: str = ""
+    language: str = "eng"
+    default: bool = True
+    forced: bool = False
+
+
+@dataclass
+class MKVInfo:
+    title: str = ""
+    # Seconds, or None if the file has no duration
+    duration: float = None
+    muxing_app: str = ""
+    writing_app: str = ""
+    tracks: list = field(default_factory=list[Track])
+
+
+def read_vint(data, offset: int) -> tuple[int, int]:
+    """
+    Read a variable size integer, keeping its length marker.
+
+    Returns the raw value and its length in bytes.
+    """
+    first = data[offset]
+    if not first:
+        raise EBMLError(f"Invalid variable size integer at {offset}")
+    length = 9 - first.bit_length()
+    if offset + length > len(data):
+        raise EBMLError(f"Truncated variable size integer at {offset}")
+    return int.from_bytes(data[offset : offset + length], "big"), length
+
+
+def read_element_id(data, offset: int) -> tuple[int, int]:
+    """Read an element id. Returns the id and its length in bytes."""
+    element_id, length = read_vint(data, offset)
+    if length > 4:
+        raise EBMLError(f"Invalid element id at {offset}")
+    return element_id, length
+
+
+def read_element_size(data, offset: int) -> tuple[int, int]:
+    """Read an element size. Returns the size, or UNKNOWN_SIZE, and its length in bytes."""
+    value, length = read_vint(data, offset)
+    marker = 1 << (7 * length)
+    size = value ^ marker
+    if size == marker - 1:
+        return UNKNOWN_SIZE, length
+    return size, length
+
+
+def read_element_header(data, offset: int) -> tuple[int, int, int]:
+    """
+    Read the id and size of the element at offset.
+
+    Returns the id, the size of its data and the offset of its data.
+    """
+    element_id, id_length = read_element_id(data, offset)
+    size, size_length = read_element_size(data, offset + id_length)
+    return element_id, size, offset + id_length + size_length
+
+
+def iter_elements(data, start: int, end: int):
+    """Iterate over the (id, size, data offset) of every element from start to end."""
+    offset = start
+    while offset < end:
+        element_id, size, data_offset = read_element_header(data, offset)
+        if size == UNKNOWN_SIZE:
+            raise EBMLError(f"Element {element_id:#x} at {offset} has an unknown size")
+        yield element_id, size, data_offset
+        offset = data_offset + size
+
+
+def read_uint(data, offset: int, size: int) -> int:
+    return int.from_bytes(data[offset : offset + size], "big")
+
+
+def read_float(data, offset: int, size: int) -> float:
+    match size:
+        case 0:
+            return 0.0
+        case 4:
+            return struct.unpack(">f", data[offset : offset + 4])[0]
+        case 8:
+            return struct.unpack(">d", data[offset : offset + 8])[0]
+    raise EBMLError(f"Invalid float size {size} at {offset}")
+
+
+def encode_size(size: int, length: int = None) -> bytes:
+    """Encode an element size in length bytes, or as few as possible if length is None."""
+    if length is None:
+        length = 1
+        while size >= (1 << (7 * length)) - 1:
+            length += 1
+    if length > 8 or size >= (1 << (7 * length)) - 1:
+        raise EBMLError(f"Size {size} does not fit in {length} bytes")
+    return ((1 << (7 * length)) | size).to_bytes(length, "big")
+
+
+def encode_element(element_id: int, data: bytes, size_length: int = None) -> bytes:
+    id_length = (element_id.bit_length() + 7) // 8
+    return (
+        element_id.to_bytes(id_length, "big")
+        + encode_size(len(data), size_length)
+        + data
+    )
+
+
+def encode_void(total: int) -> bytes:
+    """Encode a Void element that takes up exactly total bytes, which must be at least 2."""
+    for length in range(1, 9):
+        size = total - 1 - length
+        if 0 <= size < (1 << (7 * length)) - 1:
+            return encode_element(VOID, b"\0" * size, length)
+    raise EBMLError(f"No Void element takes up {total} bytes")
+
+
+def read_string(data, offset: int, size: int) -> str:
+    # Strings may be padded with zeros
+    value = bytes(data[offset : offset + size]).split(b"\0", 1)[0]
+    return value.decode("utf-8", errors="replace")
+
+
+class Segment:
+    """
+    The layout of a Matroska file's first Segment, read from the head of the file.
+
+    Elements found in the head are read from the memory map.
+    Elements the SeekHead points to beyond it are read with a single positioned read each.
+    """
+
+    def __init__(self, file, head, file_size: int) -> None:
+        self.file = file
+        self.head = head
+        self.file_size = file_size
+        # Top level elements by id, as (header offset, data size, data offset)
+        self.elements = {}
+        self._read_layout()
+
+    def _read_layout(self) -> None:
+        head = self.head
+        element_id, size, offset = read_element_header(head, 0)
+        if element_id != EBML:
+            raise EBMLError("Not an EBML file")
+
+        doc_type = ""
+        for child_id, child_size, child_offset in iter_elements(
+            head, offset, offset + size
+        ):
+            if child_id == DOC_TYPE:
+                doc_type = read_string(head, child_offset, child_size)
+        if doc_type not in DOC_TYPES:
+            raise EBMLError(f"Unsupported document type {doc_type!r}")
+
+        segment_offset = offset + size
+        element_id, size, self.data_offset = read_element_header(head, segment_offset)
+        if element_id != SEGMENT:
+            raise EBMLError("No Segment after the EBML header")
+        self.end = self.file_size
+        if size != UNKNOWN_SIZE:
+            self.end = min(self.data_offset + size, self.file_size)
+
+        # Walk the top level elements in the head, up to the first Cluster
+        offset = self.data_offset
+        head_end = min(len(head), self.end)
+        while offset < head_end:
+            try:
+                element_id, size, data_offset = read_element_header(head, offset)
+            except EBMLError:
+                # The next header runs past the head
+                break
+            if element_id == CLUSTER or size == UNKNOWN_SIZE:
+                break
+            if element_id not in self.elements:
+                self.elements[element_id] = (offset, size, data_offset)
+            offset = data_offset + size
+
+        if SEEK_HEAD in self.elements:
+            self._read_seek_head()
+
+    def _read_seek_head(self) -> None:
+        """Add the top level elements the SeekHead points to, without reading them yet."""
+        data, start, end = self.read(SEEK_HEAD)
+        for element_id, size, offset in iter_elements(data, start, end):
+            if element_id != SEEK:
+                continue
+            seek_id = None
+            position = None
+            for child_id, child_size, child_offset in iter_elements(
+                data, offset, offset + size
+            ):
+                if child_id == SEEK_ID:
+                    seek_id = read_uint(data, child_offset, child_size)
+                elif child_id == SEEK_POSITION:
+                    position = read_uint(data, child_offset, child_size)
+            if seek_id is None or position is None or seek_id in self.elements:
+                continue
+
+            offset = self.data_offset + position
+            if offset >= self.end:
+                continue
+            try:
+                header = self.read_bytes(offset, 12)
+                element_id, size, header_length = read_element_header(header, 0)
+            except (EBMLError, IndexError):
+                continue
+            if element_id == seek_id and size != UNKNOWN_SIZE:
+                self.elements[seek_id] = (offset, size, offset + header_length)
+
+    def read_bytes(self, offset: int, size: int) -> bytes:
+        if offset + size <= len(self.head):
+            return self.head[offset : offset + size]
+        return os.pread(self.file.fileno(), size, offset)
+
+    def read(self, element_id: int):
+        """
+        Get the data of a top level element.
+
+        Returns a buffer and the start and end offsets of the element's data in it,
+        or None if the element does not exist.
+        """
+        if element_id not in self.elements:
+            return None
+        _, size, data_offset = self.elements[element_id]
+        if data_offset + size > self.file_size:
+            raise EBMLError(f"Element {element_id:#x} runs past the end of the file")
+        if data_offset + size <= len(self.head):
+            return self.head, data_offset, data_offset + size
+        return os.pread(self.file.fileno(), size, data_offset), 0, size
+
+
+def _read_info(segment: Segment, info: MKVInfo) -> None:
+    element = segment.read(INFO)
+    if not element:
+        return
+    data, start, end = element
+
+    timestamp_scale = 1000000
+    duration = None
+    for element_id, size, offset in iter_elements(data, start, end):
+        if element_id == TIMESTAMP_SCALE:
+            timestamp_scale = read_uint(data, offset, size)
+        elif element_id == DURATION:
+            duration = read_float(data, offset, size)
+        elif element_id == TITLE:
+            info.title = read_string(data, offset, size)
+        elif element_id == MUXING_APP:
+            info.muxing_app = read_string(data, offset, size)
+        elif element_id == WRITING_APP:
+            info.writing_app = read_string(data, offset, size)
+
+    if duration is not None:
+        info.duration = duration * timestamp_scale / 1e9
+
+
+def _read_track(data, start: int, end: int) -> Track:
+    track = Track()
+    language_ietf = ""
+    for element_id, size, offset in iter_elements(data, start, end):
+        if element_id == TRACK_NUMBER:
+            track.number = read_uint(data, offset, size)
+        elif element_id == TRACK_TYPE:
+            track_type = read_uint(data, offset, size)
+            track.type = TRACK_TYPES.get(track_type, str(track_type))
+        elif element_id == CODEC_ID:
+            track.codec = read_string(data, offset, size)
+        elif element_id == NAME:
+            track.name = read_string(data, offset, size)
+        elif element_id == LANGUAGE:
+            track.language = read_string(data, offset, size)
+        elif element_id == LANGUAGE_IETF:
+            language_ietf = read_string(data, offset, size)
+        elif element_id == FLAG_DEFAULT:
+            track.default = bool(read_uint(data, offset, size))
+        elif element_id == FLAG_FORCED:
+            track.forced = bool(read_uint(data, offset, size))
+
+    # The IETF language replaces the legacy one when both are set
+    if language_ietf:
+        track.language = language_ietf
+    return track
+
+
+def _read_tracks(segment: Segment, info: MKVInfo) -> None:
+    element = segment.read(TRACKS)
+    if not element:
+        return
+    data, start, end = element
+
+    for element_id, size, offset in iter_elements(data, start, end):
+        if element_id == TRACK_ENTRY:
+            info.tracks += [_read_track(data, offset, offset + size)]
+
+
+@contextmanager
+def _open_segment(file):
+    """Memory map the head of an open file and read its Segment layout."""
+    file_size = os.fstat(file.fileno()).st_size
+    if not file_size:
+        raise EBMLError("Empty file")
+
+    with mmap.mmap(
+        file.fileno(), min(file_size, HEAD_SIZE), access=mmap.ACCESS_READ
+    ) as head:
+        try:
+            yield Segment(file, head, file_size)
+        except (IndexError, struct.error) as error:
+            raise EBMLError(f"Damaged file: {error}") from error
+
+
+def read_info(video: Path) -> MKVInfo:
+    """
+    Read the title, duration, muxing app and tracks of a Matroska file.
+
+    Only the head of the file is memory mapped, plus a positioned read for Info or Tracks
+    if the SeekHead places them further in.
+    Raises EBMLError if the file is not Matroska or is damaged.
+    """
+    with open(video, "rb") as file, _open_segment(file) as segment:
+        info = MKVInfo()
+        _read_info(segment, info)
+        _read_tracks(segment, info)
+    return info
+
+
+def _build_info(segment: Segment, title: str) -> bytes | None:
+    """
+    Get the data of the Info element with its Title replaced.
+
+    Returns None if Info has a CRC-32, which the new data would no longer match.
+    """
+    data, start, end = segment.read(INFO)
+    title_element = encode_element(TITLE, title.encode("utf-8")) if title else b""
+
+    # Other children are copied byte for byte, headers included
+    children = []
+    offset = start
+    while offset < end:
+        element_id, size, data_offset = read_element_header(data, offset)
+        if size == UNKNOWN_SIZE:
+            raise EBMLError(f"Element {element_id:#x} at {offset} has an unknown size")
+        if element_id == CRC32:
+            return None
+        if element_id == TITLE:
+            children += [title_element]
+            title_element = b""
+        else:
+            children += [bytes(data[offset : data_offset + size])]
+        offset = data_offset + size
+    return b"".join(children) + title_element
+
+
+def write_title(video: Path, title: str) -> bool:
+    """
+    Rewrite the title of a Matroska file in place.
+
+    The new Info element is written over the old one and the Void element after it,
+    if there is one, with a single positioned write followed by fsync.
+    No other element moves, so the SeekHead and Cues stay valid.
+    Returns False without changing the file if the title does not fit
+    or Info is protected by a CRC-32.
+    Raises EBMLError if the file is not Matroska or is damaged.
+    """
+    with open(video, "r+b") as file:
+        with _open_segment(file) as segment:
+            if INFO not in segment.elements:
+                return False
+            info_offset, info_size, info_data_offset = segment.elements[INFO]
+            space = info_data_offset + info_size - info_offset
+
+            # Padding left by the muxer right after Info
+            void_offset = info_offset + space
+            if void_offset < segment.end:
+                try:
+                    header = segment.read_bytes(void_offset, 12)
+                    element_id, size, data_offset = read_element_header(header, 0)
+                except EBMLError:
+                    element_id = None
+                if element_id == VOID and size != UNKNOWN_SIZE:
+                    space += data_offset + size
+
+            data = _build_info(segment, title)
+            if data is None:
+                return False
+
+        # Keep the size length of the original header if possible, so nothing else shifts
+        size_length = info_data_offset - info_offset - 4
+        for length in [size_length] + list(range(1, 9)):
+            try:
+                info = encode_element(INFO, data, length)
+            except EBMLError:
+                continue
+            padding = space - len(info)
+            if padding == 0:
+                break
+            # The smallest Void element is 2 bytes
+            if padding >= 2:
+                info += encode_void(padding)
+                break
+        else:
+            return False
+
+        os.pwrite(file.fileno(), info, info_offset)
+        os.fsync(file.fileno())
+    return True
@@ -1,51 +1,262 @@
+import sys
+import os
 import json
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 import shutil
 
+sys.path.append(Path(__file__).parent.parent.as_posix())
+from backend.ebml import EBMLError, MKVInfo, Track, read_info, write_title
+from backend.probe import get_probe_cache
+
 
 def get_metadata_title(video: Path) -> str:
     """
     Get metadata title for a given MKV file
     """
-    mkvmerge = Path(shutil.which("mkvmerge"))
+    return probe(video).title.strip()
+
+
+def probe(video: Path) -> MKVInfo:
+    """
+    Get the title, duration and tracks of an MKV file.
+
+    Files that have not changed since they were last probed are answered from the probe cache.
+    Others are read natively, and mkvmerge is only run for files that can't be read that way.
+    Files that could not be probed get an empty MKVInfo, which is not cached.
+    """
+    cache = get_probe_cache()
+    stat = os.stat(video)
+    info = cache.get(video, stat)
+    if info:
+        return info
+
+    try:
+        info = read_info(video)
+    except EBMLError:
+        info = _get_mkvmerge_info(video)
+    if info is None:
+        return MKVInfo()
+    cache.set(video, info, stat)
+    return info
+
+
+def _get_mkvmerge_info(video: Path) -> MKVInfo | None:
+    """
+    Get the title, duration and tracks of a given MKV file with mkvmerge
+
+    Returns None if mkvmerge could not read the file.
+    """
+    mkvmerge = shutil.which("mkvmerge")
     if not mkvmerge:
         raise FileNotFoundError("mkvmerge not in PATH!")
+    mkvmerge = Path(mkvmerge)
 
-    command = [mkvmerge.as_posix(), "-J", video.as_posix()]
+    command = [mkvmerge.as_posix(), "-J", Path(video).as_posix()]
+    info = MKVInfo()
 
     try:
         output = subprocess.check_output(command, stderr=subprocess.DEVNULL)
         data = json.loads(output)
+    except (subprocess.CalledProcessError, json.JSONDecodeError):
+        return None
+
+    if "container" in data:
+        if "properties" in data["container"]:
+            properties = data["container"]["properties"]
+            if "title" in properties:
+                info.title = properties["title"]
+            if "duration" in properties:
+                info.duration = properties["duration"] / 1e9
+            if "muxing_application" in properties:
+                info.muxing_app = properties["muxing_application"]
+            if "writing_application" in properties:
+                info.writing_app = properties["writing_application"]
 
-        if "container" in data:
-            if "properties" in data["container"]:
-                if "title" in data["container"]["properties"]:
-                    return data["container"]["properties"]["title"].strip()
+    if "tracks" in data:
+        for t in data["tracks"]:
+            track = Track()
+            if "type" in t:
+                track.type = t["type"]
+            if "properties" in t:
+                properties = t["properties"]
+                if "number" in properties:
+                    track.number = properties["number"]
+                if "codec_id" in properties:
+                    track.codec = properties["codec_id"]
+                if "track_name" in properties:
+                    track.name = properties["track_name"]
+                if "language" in properties:
+                    track.language = properties["language"]
+                if "language_ietf" in properties:
+                    track.language = properties["language_ietf"]
+                if "default_track" in properties:
+                    track.default = properties["default_track"]
+                if "forced_track" in properties:
+                    track.forced = properties["forced_track"]
+            info.tracks += [track]
 
-    except subprocess.CalledProcessError:
-        return ""
+    return info
 
 
 def set_metadata_title(title: str, video: Path) -> None:
     """
     Set metadata title for a given MKV file
+
+    The title is rewritten in place when it fits in the existing Info and padding,
+    and mkvpropedit is only run otherwise.
+    """
+    apply_plan(EditPlan(video, title=title.strip()))
+
+
+@dataclass
+class TrackEdit:
+    """Changes to a single track. Properties left as None are not changed."""
+
+    name: str = None
+    language: str = None
+    default: bool = None
+
+
+@dataclass
+class EditPlan:
     """
-    title = title.strip()
-    mkvpropedit = Path(shutil.which("mkvpropedit"))
+    Every pending change to a single MKV file, applied with one mkvpropedit run.
+
+    Properties left as None are not changed.
+    Tracks are keyed by their track number, as in Track.number.
+    tags is an XML file in the Matroska tags format that replaces the global tags.
+    """
+
+    video: Path
+    title: str = None
+    tracks: dict = field(default_factory=dict[int, TrackEdit])
+    tags: Path = None
+
+    def get_track(self, number: int) -> TrackEdit:
+        if number not in self.tracks:
+            self.tracks[number] = TrackEdit()
+        return self.tracks[number]
+
+    def set_track_name(self, number: int, name: str) -> None:
+        self.get_track(number).name = name
+
+    def set_track_language(self, number: int, language: str) -> None:
+        self.get_track(number).language = language
+
+    def set_default_track(self, number: int, default: bool = True) -> None:
+        self.get_track(number).default = default
+
+    def is_empty(self) -> bool:
+        tracks = [track for track in self.tracks.values() if track != TrackEdit()]
+        return self.title is None and not tracks and self.tags is None
+
+    def is_title_only(self) -> bool:
+        return self.title is not None and self == EditPlan(self.video, self.title)
+
+    def get_arguments(self) -> list[str]:
+        """Get the mkvpropedit arguments for every change, without the file name."""
+        arguments = []
+        if self.title is not None:
+            arguments += ["--edit", "info", "--set", f"title={self.title}"]
+
+        for number, track in sorted(self.tracks.items()):
+            properties = []
+            if track.name is not None:
+                properties += ["--set", f"name={track.name}"]
+            if track.language is not None:
+                properties += ["--set", f"language={track.language}"]
+            if track.default is not None:
+                properties += ["--set", f"flag-default={int(track.default)}"]
+            if properties:
+                # track:=N selects by track number rather than position
+                arguments += ["--edit", f"track:={number}"] + properties
+
+        if self.tags is not None:
+            arguments += ["--tags", f"global:{Path(self.tags).as_posix()}"]
+        return arguments
+
+
+def apply_plan(plan: EditPlan) -> bool:
+    """
+    Apply every change in an edit plan to its file.
+
+    A plan that only changes the title is written in place when it fits, without mkvpropedit.
+    Everything else is done by a single mkvpropedit run.
+    The file's probe is dropped from the probe cache after a successful edit,
+    since its size and modification time may not change.
+    Returns False if mkvpropedit failed.
+    """
+    if plan.is_empty():
+        return True
+
+    if plan.is_title_only():
+        try:
+            if write_title(plan.video, plan.title):
+                get_probe_cache().delete(plan.video)
+                return True
+        except EBMLError:
+            pass
+
+    mkvpropedit = shutil.which("mkvpropedit")
     if not mkvpropedit:
         raise FileNotFoundError("mkvpropedit not in PATH!")
-    command = [
-        mkvpropedit.as_posix(),
-        video.as_posix(),
-        "--edit",
-        "info",
-        "--set",
-        "title={}".format(title),
-    ]
-    try:
-        subprocess.check_call(
-            command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    mkvpropedit = Path(mkvpropedit)
+    command = [mkvpropedit.as_posix(), Path(plan.video).as_posix()]
+    command += plan.get_arguments()
+
+    result = subprocess.run(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    # mkvpropedit exits with 1 for warnings and 2 for errors
+    if result.returncode not in (0, 1):
+        return False
+    get_probe_cache().delete(plan.video)
+    return True
+
+
+def apply_plans(plans: list[EditPlan], workers: int = 4) -> list[bool]:
+    """
+    Apply many edit plans on a pool of workers, one mkvpropedit run per file.
+
+    Returns whether each plan succeeded, in the same order as plans.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(apply_plan, plans))
+
+
+def _benchmark(directory: Path) -> None:
+    """
+    Compare probing every MKV file under directory natively, through the probe cache
+    and with mkvmerge.
+    """
+    videos = sorted(directory.rglob("*.mkv"))
+    if not videos:
+        print(f"No MKV files in {directory}")
+        return
+
+    paths = {"native": read_info, "cached": probe, "mkvmerge": _get_mkvmerge_info}
+    if not shutil.which("mkvmerge"):
+        paths.pop("mkvmerge")
+
+    print(f"{len(videos)} files")
+    for name, function in paths.items():
+        failed = 0
+        start = time.perf_counter()
+        for video in videos:
+            try:
+                function(video)
+            except (EBMLError, OSError):
+                failed += 1
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:>8}: {elapsed:.3f}s total, "
+            f"{elapsed / len(videos) * 1000:.2f}ms per file, {failed} failed"
         )
-    except subprocess.CalledProcessError:
-        pass
+
+
+if __name__ == "__main__":
+    _benchmark(Path(sys.argv[1] if len(sys.argv) > 1 else "."))
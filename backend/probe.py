@@ -0,0 +1,148 @@
+import sys
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import platformdirs
+
+sys.path.append(Path(__file__).parent.parent.as_posix())
+from backend.ebml import MKVInfo
+
+
+class ProbeCache:
+    """
+    Keep the probed title, duration and tracks of every video between runs.
+
+    Entries are keyed by the file's device and inode and are only used while its size
+    and modification time are unchanged, so edited or replaced files are probed again.
+    Results are pickled and compressed into a sqlite database.
+    Once more than max_entries are stored, the oldest probes are removed.
+    """
+
+    def __init__(
+        self,
+        path: Path = None,
+        max_entries: int = 100000,
+        check_interval: int = 100,
+    ) -> None:
+        if not path:
+            path = platformdirs.user_cache_path("video-preview").joinpath(
+                "probes.sqlite"
+            )
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                "key TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "path TEXT, info BLOB, probed REAL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS probes_probed ON probes (probed)"
+            )
+
+    @staticmethod
+    def make_key(stat: os.stat_result) -> str:
+        """Create a key from the device and inode of a file."""
+        return f"{stat.st_dev}:{stat.st_ino}"
+
+    def get(self, video: Path, stat: os.stat_result = None) -> MKVInfo | None:
+        """Get the cached probe of a video, or None if it was never probed or has changed."""
+        if stat is None:
+            try:
+                stat = os.stat(video)
+            except OSError:
+                return None
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, info FROM probes WHERE key = ?",
+                (self.make_key(stat),),
+            ).fetchone()
+        if not row:
+            return None
+
+        size, mtime_ns, info = row
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return None
+
+        try:
+            return pickle.loads(zlib.decompress(info))
+        except Exception:
+            # Probes written by an older version of MKVInfo may not load
+            return None
+
+    def set(self, video: Path, info: MKVInfo, stat: os.stat_result = None) -> None:
+        """
+        Store the probe of a video, replacing any earlier probe of the same file.
+
+        stat should be taken before probing, so a file changed while it was probed
+        is probed again next time.
+        """
+        if stat is None:
+            stat = os.stat(video)
+        data = zlib.compress(pickle.dumps(info, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self.make_key(stat),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    Path(video).as_posix(),
+                    data,
+                    time.time(),
+                ),
+            )
+            self._writes += 1
+            if self._writes % self.check_interval == 0:
+                self._evict()
+
+    def delete(self, video: Path) -> None:
+        """Remove the probe of a video, so it is probed again next time."""
+        try:
+            stat = os.stat(video)
+        except OSError:
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM probes WHERE key = ?", (self.make_key(stat),)
+            )
+
+    def _evict(self) -> None:
+        """Remove the oldest probes until no more than max_entries are left."""
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM probes").fetchone()
+        if count <= self.max_entries:
+            return
+        self._connection.execute(
+            "DELETE FROM probes WHERE key IN "
+            "(SELECT key FROM probes ORDER BY probed LIMIT ?)",
+            (count - self.max_entries,),
+        )
+
+
+_probe_cache = None
+_probe_cache_lock = threading.Lock()
+
+
+def get_probe_cache() -> ProbeCache:
+    """Get the probe cache shared by the rename flow, the video tree and batch tools."""
+    global _probe_cache
+
+    with _probe_cache_lock:
+        if not _probe_cache:
+            _probe_cache = ProbeCache()
+        return _probe_cache
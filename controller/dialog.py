@@ -8,10 +8,49 @@ from model.metadata import Series
 
 class DialogController:
     def __init__(self, dialog: SelectionDialog, data: Series):
+        self.dialog = dialog
+        self._added = set()
         self._populate_dialog(dialog, data)
 
     def _populate_dialog(self, dialog, data):
         dialog.clear()
+        self.add_items(data)
+
+    def add_items(self, data):
+        """
+        Add valid results to the dialog. This may be called as results arrive.
+
+        Results already shown, for example from the local index, are skipped.
+        """
         for x in data:
-            if x.is_valid():
-                dialog.add_item(f"[{x.source}] {x.name} ({x.year})", x)
+            if x.is_valid_stub():
+                text = f"[{x.source}] {x.name} ({x.year})"
+                if text not in self._added:
+                    self._added.add(text)
+                    self.dialog.add_item(text, x)
+
+    def add_episode_items(self, data):
+        """Add (series, episode) results from an episode title search."""
+        for x, episode in data:
+            if x.is_valid_stub():
+                text = "[{}] {} ({}) S{}E{} - {}".format(
+                    x.source,
+                    x.name,
+                    x.year,
+                    str(episode.season_number).zfill(2),
+                    str(episode.number).zfill(2),
+                    episode.name,
+                )
+                if text not in self._added:
+                    self._added.add(text)
+                    self.dialog.add_item(text, x)
+
+    def clear(self):
+        self._added = set()
+        self.dialog.clear()
+
+    def set_searching(self, searching: bool):
+        self.dialog.set_searching(searching)
+
+    def finish(self, data=None):
+        self.set_searching(False)
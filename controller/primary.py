@@ -2,6 +2,8 @@ import sys
 from pathlib import Path
 
 sys.path.append(Path(__file__).parent.parent.as_posix())
+# Share the modules providers import relative to the model directory
+sys.path.append(Path(__file__).parent.parent.joinpath("model").as_posix())
 
 from view.video_tree import VideoTree
 from view.metadata_preview import SeriesMetadataPreview, MetadataPreview
@@ -14,36 +16,249 @@ from model.tmdb import MetadataDownloader as TMDBDownloader
 from model.tvdb import MetadataDownloader as TVDBDownloader
 from model.omdb import MetadataDownloader as OMDBDownloader
 from controller.dialog import DialogController
+from client import CancelToken, CancelledError, set_cache_only, set_cancel_token
+from index import get_media_index
 from backend.mkvtoolnix import get_metadata_title
+from backend.bulk import BulkProbe, find_videos
 from PyQt6.QtWidgets import QDialog, QListWidgetItem, QFileDialog
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QEventLoop
+from PyQt6.QtCore import Qt, QObject, QThread, QTimer, pyqtSignal, QEventLoop
 from backend.mkvtoolnix import set_metadata_title
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import functools
+import threading
 from dataclasses import dataclass
 from enum import StrEnum
 
 
-class SearchWorker(QThread):
+class SearchJob(QObject):
+    """
+    A search of every provider for a single query, run on a SearchWorker's thread pool.
+
+    search_result is emitted with each provider's results as soon as they arrive.
+    search_finished is emitted once with all results, ordered by provider.
+    Providers that have not answered before the deadline (in seconds) are dropped.
+    Providers that are known to have no results for the query are skipped without a request.
+    Once cancelled, requests that have not been sent yet are dropped and nothing more is emitted.
+    A cache_only search never sends a request and only finds what the providers answered before.
+    """
+
+    search_result = pyqtSignal(list)
     search_finished = pyqtSignal(list)
 
-    def __init__(self, providers, search_query, mode="SERIES"):
+    def __init__(
+        self, providers, search_query, mode="SERIES", deadline=30, cache_only=False
+    ):
         super().__init__()
         self.providers = providers
         self.search_query = search_query
         self.mode = mode
+        self.deadline = deadline
+        self.cache_only = cache_only
+        self.token = CancelToken()
+        self.finished = False
+        self._provider_results = {}
+        self._pending = set()
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def _is_known_empty(self, provider):
+        match self.mode:
+            case "SERIES":
+                return provider.is_known_empty(self.search_query, kind="series")
+            case "MOVIE":
+                return provider.is_known_empty(self.search_query, kind="movie")
+        return False
+
+    def _search(self, provider):
+        set_cancel_token(self.token)
+        set_cache_only(self.cache_only)
+        try:
+            match self.mode:
+                case "SERIES":
+                    return provider.search_series_stubs(self.search_query)
+                case "MOVIE":
+                    return provider.search_movies_stubs(self.search_query)
+            return []
+        finally:
+            set_cancel_token(None)
+            set_cache_only(False)
+
+    def start(self, executor):
+        providers = []
+        if self.search_query:
+            providers = [
+                provider
+                for provider in self.providers
+                if not self._is_known_empty(provider)
+            ]
+
+        if not providers:
+            # Finish from the event loop, once the caller has connected search_finished
+            QTimer.singleShot(0, self._finish)
+            return
+
+        self._pending = set(providers)
+        QTimer.singleShot(int(self.deadline * 1000), self._finish)
+        for provider in providers:
+            future = executor.submit(self._search, provider)
+            future.add_done_callback(
+                functools.partial(self._on_provider_done, provider)
+            )
+            self._futures += [future]
+
+    def cancel(self):
+        self.token.cancel()
+        with self._lock:
+            self.finished = True
+        for future in self._futures:
+            future.cancel()
+
+    def _on_provider_done(self, provider, future):
+        """Collect a provider's results. This runs on the thread pool."""
+        results = []
+        if not future.cancelled():
+            try:
+                results = future.result()
+            except CancelledError:
+                pass
+            except Exception as error:
+                print(f"{type(provider).__module__} search failed: {error}")
+
+        with self._lock:
+            if self.finished:
+                return
+            self._provider_results[provider] = results
+            self._pending.discard(provider)
+            done = not self._pending
+
+        if results:
+            self.search_result.emit(results)
+        if done:
+            self._finish()
+
+    def _finish(self):
+        # Any provider still running is dropped and partial results are used
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
 
-    def run(self):
         search_results = []
-        if self.search_query:
-            for provider in self.providers:
-                match self.mode:
-                    case "SERIES":
-                        search_results += provider.search_series(self.search_query)
-                    case "MOVIE":
-                        search_results += provider.search_movies(self.search_query)
+        for provider in self.providers:
+            if provider in self._provider_results:
+                search_results += self._provider_results[provider]
 
         self.search_finished.emit(search_results)
 
 
+class SearchWorker:
+    """
+    Run searches on a long-lived, bounded thread pool shared by every query.
+
+    Only lightweight stubs are returned. Use HydrateWorker to fetch the full details.
+    """
+
+    def __init__(self, max_workers=8):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def start(self, job: SearchJob):
+        """Start a search. Connect to the job's signals before starting it."""
+        job.start(self.executor)
+
+
+class HydrateWorker(QThread):
+    """
+    Fetch the full details of a search result.
+
+    hydrate_progress is emitted with a copy of the partially built series
+    as seasons or pages of episodes arrive, since the worker keeps changing the original.
+    hydrate_finished is emitted once with the finished result, or None if it failed.
+    """
+
+    hydrate_progress = pyqtSignal(object)
+    hydrate_finished = pyqtSignal(object)
+
+    def __init__(self, provider, media):
+        super().__init__()
+        self.provider = provider
+        self.media = media
+
+    def run(self):
+        media = None
+        try:
+            # Hydrate a copy so the stub can be selected again later
+            media = self.provider.hydrate(
+                copy.deepcopy(self.media), on_progress=self._emit_progress
+            )
+        except Exception as error:
+            print(f"{type(self.provider).__module__} hydrate failed: {error}")
+        self.hydrate_finished.emit(media)
+
+    def _emit_progress(self, media):
+        self.hydrate_progress.emit(copy.deepcopy(media))
+
+
+class EpisodeWorker(QThread):
+    """Fetch the details of a single episode that was loaded without them."""
+
+    hydrate_finished = pyqtSignal(object)
+
+    def __init__(self, provider, episode):
+        super().__init__()
+        self.provider = provider
+        self.episode = episode
+
+    def run(self):
+        try:
+            self.provider.hydrate_episode(self.episode)
+        except Exception as error:
+            print(f"{type(self.provider).__module__} episode hydrate failed: {error}")
+        self.hydrate_finished.emit(self.episode)
+
+
+class ProbeWorker(QThread):
+    """
+    Probe the title, duration and tracks of every video under a directory.
+
+    probe_result is emitted with each video and its MKVInfo, or None if it could not be probed.
+    probe_progress is emitted with the number of videos probed so far and the total.
+    Results are also kept in the probe cache, which the video tree reads.
+    """
+
+    probe_result = pyqtSignal(object, object)
+    probe_progress = pyqtSignal(int, int)
+
+    def __init__(self, root: Path):
+        super().__init__()
+        self.root = root
+        self.bulk_probe = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.bulk_probe:
+            self.bulk_probe.cancel()
+
+    def run(self):
+        try:
+            videos = find_videos(self.root)
+        except OSError as error:
+            print(f"Listing videos in {self.root} failed: {error}")
+            return
+
+        self.bulk_probe = BulkProbe(videos)
+        if self._cancelled.is_set():
+            return
+
+        done = 0
+        self.probe_progress.emit(done, len(videos))
+        for video, info in self.bulk_probe.run():
+            done += 1
+            self.probe_result.emit(video, info)
+            self.probe_progress.emit(done, len(videos))
+
+
 class PrimaryController:
     @dataclass
     class MODE(StrEnum):
@@ -64,6 +279,33 @@ class PrimaryController:
 
         self.series = None
         self.series_list = []
+        self.hydrate_worker = None
+        # Whether a chosen series is still loading, with the window disabled
+        self.hydrating = False
+        # Whether the series being loaded has been shown yet
+        self.hydrate_shown = False
+        self.episode_workers = []
+        self.probe_worker = None
+
+        # Searches share one long-lived pool, and only the latest search is kept running
+        self.search_worker = SearchWorker()
+        self.worker = None
+
+        # Start searching once typing has paused for this many milliseconds
+        self.search_timer = QTimer()
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(300)
+        self.search_timer.timeout.connect(self._search_as_you_type)
+
+        # Shorter queries are only answered from the local index while typing
+        self.min_search_length = 3
+
+        # Everything the providers have returned before, searchable without any requests
+        self.index = get_media_index()
+        # (series, episode) pairs found by the last episode title search
+        self.episode_matches = []
+        # (season number, episode number) to select once the chosen series has loaded
+        self.pending_episode = None
 
         self.providers = [
             TMDBDownloader(),
@@ -71,6 +313,12 @@ class PrimaryController:
             TVMazeDownloader(),
             OMDBDownloader(),  # This API is very limited. It should always be last.
         ]
+        self.providers_by_source = {
+            provider.source: provider for provider in self.providers
+        }
+
+        # Providers with fewer requests than this left today are searched last
+        self.low_quota = 50
 
         self.mode = PrimaryController.MODE.MEDIA.value
         if type(self.metadata_preview) is SeriesMetadataPreview:
@@ -92,6 +340,11 @@ class PrimaryController:
         )
         self.metadata_preview.search_button.clicked.connect(self._open_search_dialog)
 
+        # search while typing once the user pauses
+        self.metadata_preview.search_field.textChanged.connect(
+            self._search_text_changed
+        )
+
         # click on video tree button to run _open_video_directory
         self.video_tree.set_root_button.clicked.connect(self._open_video_directory)
 
@@ -113,52 +366,239 @@ class PrimaryController:
         # Focus query field on startup
         self.metadata_preview.search_field.setFocus()
 
-    def _search_series_metadata(self):
-        loop = QEventLoop()
-        self._start_search_series_metadata(callback=loop.quit)
-        loop.exec()
-
-    def _start_search_series_metadata(self, callback) -> list[Series]:
+    def _get_search_providers(self) -> list:
+        """
+        Get the providers to search in order of preference.
+
+        Providers with no requests left today are skipped.
+        Providers that are close to their daily quota are moved to the end.
+        """
+        providers = []
+        low_providers = []
+        for provider in self.providers:
+            remaining = provider.remaining()
+            if remaining is None or remaining > self.low_quota:
+                providers += [provider]
+            elif remaining > 0:
+                low_providers += [provider]
+        return providers + low_providers
+
+    def _start_search_series_metadata(self, on_result=None, cache_only=False):
         search_query = self.metadata_preview.search_field.text().strip()
+        providers = self._get_search_providers()
+
+        # Requests of a superseded search that have not been sent yet are dropped
+        self._cancel_search()
+
         if self.mode == "SERIES":
-            self.worker = SearchWorker(self.providers, search_query, mode="SERIES")
+            self.worker = SearchJob(
+                providers, search_query, mode="SERIES", cache_only=cache_only
+            )
         elif self.mode == "MEDIA":
-            self.worker = SearchWorker(self.providers, search_query, mode="MOVIE")
+            self.worker = SearchJob(
+                providers, search_query, mode="MOVIE", cache_only=cache_only
+            )
         self.worker.search_finished.connect(self._on_search_finished)
-        if callback:
-            self.worker.search_finished.connect(callback)
-        self.worker.start()
-        self.loading_dialog.set_text("Searching...")
-        self.loading_dialog.show()
-        self.parent.setDisabled(True)
+        if on_result:
+            self.worker.search_result.connect(on_result)
+        self.search_worker.start(self.worker)
+
+    def _cancel_search(self):
+        if self.worker and not self.worker.finished:
+            self.worker.cancel()
+
+    def _search_text_changed(self):
+        """Restart the debounce timer, so searching starts once typing pauses."""
+        self.search_timer.start()
+
+    def _search_as_you_type(self):
+        """
+        Suggest names for the query being typed.
+
+        Matches from the local index are suggested straight away.
+        Longer queries also search what the providers answered before, without sending requests,
+        so typing does not use up rate limits or daily quotas.
+        """
+        search_query = self.metadata_preview.search_field.text().strip()
+        suggestions = []
+        if search_query:
+            kind = "series"
+            if self.mode == PrimaryController.MODE.MEDIA.value:
+                kind = "movie"
+            suggestions = [
+                media.name for media in self.index.search(search_query, kind)
+            ]
+        self.metadata_preview.set_suggestions(suggestions)
+
+        if len(search_query) < self.min_search_length:
+            self._cancel_search()
+            return
+
+        self._start_search_series_metadata(
+            on_result=self._add_search_suggestions, cache_only=True
+        )
+
+    def _add_search_suggestions(self, search_results):
+        self.metadata_preview.add_suggestions([media.name for media in search_results])
 
     def _on_search_finished(self, search_results):
         self.series_list = search_results
+        # A search finishing while a chosen series loads must not re-enable the window
+        if self.hydrating:
+            return
+        self.loading_dialog.hide()
+        self.parent.setEnabled(True)
+
+    def _hydrate_series_metadata(self, media):
+        """
+        Fetch the full details for the search result chosen by the user.
+
+        The metadata fields are filled in as soon as the first part arrives,
+        but the window stays disabled until the series has finished loading.
+        """
+        provider = self.providers_by_source.get(media.source)
+        if not provider:
+            return
+
+        # Ignore anything still arriving for a previously chosen series
+        if self.hydrate_worker:
+            self.hydrate_worker.hydrate_progress.disconnect()
+            self.hydrate_worker.hydrate_finished.disconnect()
+
+        self.hydrating = True
+        self.hydrate_shown = False
+        self.hydrate_worker = HydrateWorker(provider, media)
+        self.hydrate_worker.hydrate_progress.connect(self._on_hydrate_progress)
+        self.hydrate_worker.hydrate_finished.connect(self._on_hydrate_finished)
+        self.hydrate_worker.start()
+        self.loading_dialog.set_text("Loading...")
+        self.loading_dialog.show()
+        self.parent.setDisabled(True)
+
+    def _on_hydrate_progress(self, media):
+        self._show_hydrated_series(media)
+
+    def _on_hydrate_finished(self, media):
+        self.hydrating = False
         self.loading_dialog.hide()
         self.parent.setEnabled(True)
 
+        if not media or not media.is_valid():
+            return
+
+        self._show_hydrated_series(media)
+
+    def _show_hydrated_series(self, media):
+        """Show a series that is loading, keeping the selection after the first part."""
+        self.series = media
+        if self.hydrate_shown:
+            self._refresh_metadata_fields()
+        else:
+            self.hydrate_shown = True
+            self._populate_metadata_fields()
+        self._select_pending_episode()
+
+    def _select_pending_episode(self):
+        """Select the episode found by an episode title search once it has loaded."""
+        if not self.pending_episode or not self.series:
+            return
+        if not self.mode == PrimaryController.MODE.SERIES.value:
+            return
+
+        season_number, number = self.pending_episode
+        if not self.series.get_episode(season_number, number):
+            return
+        self.pending_episode = None
+        self._select_episode(season_number, number)
+
+    def _select_episode(self, season_number: int, number: int) -> None:
+        """Select an episode, switching to its season first."""
+        combobox = self.metadata_preview.season_number_combobox
+        index = combobox.findData(season_number)
+        if index < 0:
+            return
+        combobox.setCurrentIndex(index)
+
+        row = self.series.get_row(season_number, number)
+        if row is not None:
+            self.metadata_preview.episode_list.setCurrentRow(row)
+
+    def _select_next_episode(self) -> None:
+        """Select the episode after the selected one, moving on to the next season if needed."""
+        episode = self.get_selected_episode()
+        if not episode:
+            return
+
+        following = self.series.get_next_episode(episode)
+        if following:
+            self._select_episode(following.season_number, following.number)
+
+    def _add_local_results(self, dialog_controller, search_query: str):
+        """Show matches from the local index straight away, before any provider answers."""
+        self.episode_matches = []
+        match self.mode:
+            case PrimaryController.MODE.SERIES.value:
+                dialog_controller.add_items(self.index.search(search_query, "series"))
+                self.episode_matches = self.index.search_episodes(search_query)
+                dialog_controller.add_episode_items(self.episode_matches)
+            case PrimaryController.MODE.MEDIA.value:
+                dialog_controller.add_items(self.index.search(search_query, "movie"))
+
     def _open_video_directory(self):
         directory = QFileDialog.getExistingDirectory(
             None,
             "Open Folder",
             "",
         )
+        if not directory:
+            return
         self.video_tree._set_root_path(Path(directory))
+        self._start_probe_videos()
+
+    def _start_probe_videos(self):
+        """Probe every video under the video tree's root in the background."""
+        if self.probe_worker:
+            self.probe_worker.cancel()
+
+        self.probe_worker = ProbeWorker(self.video_tree.local_root)
+        self.probe_worker.probe_progress.connect(self.video_tree.set_probe_progress)
+        self.probe_worker.start()
 
     def _open_search_dialog(self) -> None:
-        # Get list of series
-        if self.metadata_preview.search_field.text().strip():
-            self._search_series_metadata()
+        # This search replaces any search started while typing
+        self.search_timer.stop()
 
-        # Get new series chosen by user
         dialog = SelectionDialog()
-        DialogController(dialog, self.series_list)
-        if dialog.exec() == QDialog.DialogCode.Accepted:
-            self.series = dialog.get_selected_data()
+        dialog_controller = DialogController(dialog, self.series_list)
 
-        # If a series was selected, populate GUI and clear query.
-        if self.series:
-            self._populate_metadata_fields()
+        # Search for new series and fill the dialog as each provider answers
+        search_query = self.metadata_preview.search_field.text().strip()
+        searching = bool(search_query)
+        if searching:
+            dialog_controller.clear()
+            dialog_controller.set_searching(True)
+            self._add_local_results(dialog_controller, search_query)
+            self._start_search_series_metadata(on_result=dialog_controller.add_items)
+            self.worker.search_finished.connect(dialog_controller.finish)
+
+        # Get new series chosen by user
+        selected = None
+        if dialog.exec() == QDialog.DialogCode.Accepted:
+            selected = dialog.get_selected_data()
+
+        # Stop feeding the dialog if the search is still running
+        if searching:
+            self.worker.search_result.disconnect(dialog_controller.add_items)
+            self.worker.search_finished.disconnect(dialog_controller.finish)
+
+        # Only the chosen search result is fully downloaded
+        # The GUI is populated once the first part of it arrives
+        if selected:
+            self.pending_episode = None
+            for series, episode in self.episode_matches:
+                if series is selected:
+                    self.pending_episode = (episode.season_number, episode.number)
+            self._hydrate_series_metadata(selected)
             self.metadata_preview.clear_query()
 
     def _populate_season_combo_box(self):
@@ -177,7 +617,7 @@ class PrimaryController:
             return
 
         # Populate season_number_combobox with new data
-        for season_number in self.series.seasons:
+        for season_number in self.series.get_season_numbers():
             # Set each combobox item with "Season XX" display text
             display_text = f"Season {season_number:02}"
 
@@ -223,8 +663,8 @@ class PrimaryController:
             return
 
         # Populate episode list
-        for number in season.episodes:
-            episode = season.episodes[number]
+        # Episodes may arrive out of order while a series is still loading
+        for episode in self.series.get_episodes(season_number):
             self._add_episode(episode)
 
         # Set first item as the selected episode
@@ -257,6 +697,10 @@ class PrimaryController:
         if not episode:
             return
 
+        # Fetch episode details in the background if they were not loaded with the series
+        if not episode.hydrated:
+            self._hydrate_episode_metadata(episode)
+
         # Populate display with metadata
         self.metadata_preview.media_name_box.setText(episode.series_name)
         self.metadata_preview.media_year_box.setText(str(self.series.year))
@@ -271,6 +715,30 @@ class PrimaryController:
         self.metadata_preview.episode_range_box.clear()
         self.metadata_preview.media_part_number_box.clear()
 
+    def _hydrate_episode_metadata(self, episode):
+        """Fetch the details of an episode, then show them if it is still selected."""
+        provider = self.providers_by_source.get(self.series.source)
+        if not provider:
+            return
+
+        # Only one request per episode at a time
+        for worker in self.episode_workers:
+            if worker.episode is episode:
+                return
+
+        worker = EpisodeWorker(provider, episode)
+        worker.hydrate_finished.connect(self._on_episode_hydrate_finished)
+        worker.finished.connect(lambda: self.episode_workers.remove(worker))
+        self.episode_workers += [worker]
+        worker.start()
+
+    def _on_episode_hydrate_finished(self, episode):
+        # A failed request leaves the episode unhydrated, so do not ask again right away
+        if not episode.hydrated:
+            return
+        if episode is self.get_selected_episode():
+            self._populate_episode_metadata()
+
     def _populate_metadata_fields(self):
         """Populate the metadata fields with the series data."""
 
@@ -285,6 +753,40 @@ class PrimaryController:
                 self._populate_episode_list(season_number)
                 self._populate_episode_metadata()
 
+    def _refresh_metadata_fields(self):
+        """
+        Refresh the season and episode lists while keeping the current selection.
+
+        This is used while a series is still loading.
+        """
+        if not self.mode == PrimaryController.MODE.SERIES.value:
+            return
+
+        combobox = self.metadata_preview.season_number_combobox
+        season_number = combobox.currentData()
+        episode = self.get_selected_episode()
+
+        # Only rebuild the season list if seasons were added or removed
+        season_numbers = [combobox.itemData(index) for index in range(combobox.count())]
+        if season_numbers != self.series.get_season_numbers():
+            combobox.blockSignals(True)
+            self._populate_season_combo_box()
+            index = combobox.findData(season_number)
+            if index >= 0:
+                combobox.setCurrentIndex(index)
+            combobox.blockSignals(False)
+            season_number = combobox.currentData()
+
+        episode_list = self.metadata_preview.episode_list
+        episode_list.blockSignals(True)
+        self._populate_episode_list(season_number)
+        if episode and episode.season_number == season_number:
+            row = self.series.get_row(season_number, episode.number)
+            if row is not None:
+                episode_list.setCurrentRow(row)
+        episode_list.blockSignals(False)
+        self._populate_episode_metadata()
+
     def get_selected_season(self) -> Season | None:
         if not self.mode == PrimaryController.MODE.SERIES.value:
             return None
@@ -446,7 +948,7 @@ class PrimaryController:
 
             if self.mode == PrimaryController.MODE.SERIES.value:
                 self.metadata_preview.episode_range_box.clear()
-                self.metadata_preview.select_next_episode()
+                self._select_next_episode()
 
             self.metadata_preview.media_part_number_box.clear()
 
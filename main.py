@@ -17,6 +17,10 @@ from view.video_tree import VideoTree
 from controller.primary import PrimaryController
 from argparse import ArgumentParser
 
+# Providers import the HTTP client relative to the model directory, so share that module
+sys.path.append(Path(__file__).parent.joinpath("model").as_posix())
+from client import configure
+
 
 class RenameWorker(QThread):
     rename_finished = pyqtSignal()
@@ -98,8 +102,22 @@ if __name__ == "__main__":
         action="store_true",
         help="Start the application in movie mode",
     )
+    parser.add_argument(
+        "-s",
+        "--stale",
+        action="store_true",
+        help="Use expired cached metadata immediately and refresh it in the background",
+    )
+    parser.add_argument(
+        "-o",
+        "--offline",
+        action="store_true",
+        help="Only use cached metadata and never connect to the network",
+    )
     args = parser.parse_args()
 
+    configure(stale_while_revalidate=args.stale, offline=args.offline)
+
     mode = PrimaryController.MODE.SERIES.value
     if args.movie:
         mode = PrimaryController.MODE.MEDIA.value
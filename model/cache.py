@@ -0,0 +1,339 @@
+import atexit
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import platformdirs
+from requests_cache import SQLiteCache
+from requests_cache.serializers import SerializerPipeline, Stage
+from requests_cache.serializers.preconf import base_stage
+
+# Cached responses are pickled and compressed
+compressed_serializer = SerializerPipeline(
+    [base_stage, Stage(pickle), Stage(zlib, dumps="compress", loads="decompress")],
+    name="pickle+zlib",
+    is_binary=True,
+)
+
+
+class ObjectCache:
+    """
+    Keep fully built Series and Movie objects between runs.
+
+    This sits in front of the HTTP cache so cached shows skip parsing and processing entirely.
+    Objects are pickled and compressed into a sqlite database.
+    Entries expire after ttl seconds, and the least recently used entries are removed
+    once more than max_size bytes are stored.
+    """
+
+    def __init__(
+        self,
+        path: Path = None,
+        ttl: int = 3600 * 24 * 7,
+        max_size: int = 256 * 1024 * 1024,
+    ) -> None:
+        if not path:
+            path = platformdirs.user_cache_path("video-preview").joinpath(
+                "objects.sqlite"
+            )
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False
+        )
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                "key TEXT PRIMARY KEY, value BLOB, size INTEGER, "
+                "expires REAL, accessed REAL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS objects_accessed ON objects (accessed)"
+            )
+
+    # Changed whenever the models change, so objects pickled by older versions are not used
+    VERSION = 3
+
+    @staticmethod
+    def make_key(provider: str, kind: str, media_id, language="", ordering="") -> str:
+        """Create a key from the provider, media kind, id, language and season ordering."""
+        return (
+            f"v{ObjectCache.VERSION}:{provider}:{kind}:{media_id}:{language}:{ordering}"
+        )
+
+    def get(self, key: str):
+        """Get a cached object, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT value, expires FROM objects WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+
+            value, expires = row
+            if expires < now:
+                self._connection.execute("DELETE FROM objects WHERE key = ?", (key,))
+                return None
+
+            self._connection.execute(
+                "UPDATE objects SET accessed = ? WHERE key = ?", (now, key)
+            )
+
+        try:
+            return pickle.loads(zlib.decompress(value))
+        except Exception:
+            # Objects written by an older version of the models may not load
+            self.delete(key)
+            return None
+
+    def set(self, key: str, value, ttl: int = None) -> None:
+        """Store an object, replacing any existing entry for the key."""
+        if ttl is None:
+            ttl = self.ttl
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now + ttl, now),
+            )
+            self._evict()
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM objects WHERE key = ?", (key,))
+
+    def _evict(self) -> None:
+        """Remove expired entries, then the least recently used ones until under max_size."""
+        self._connection.execute(
+            "DELETE FROM objects WHERE expires < ?", (time.time(),)
+        )
+        (total,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM objects"
+        ).fetchone()
+        if total <= self.max_size:
+            return
+
+        rows = self._connection.execute(
+            "SELECT key, size FROM objects ORDER BY accessed"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            self._connection.execute("DELETE FROM objects WHERE key = ?", (key,))
+            total -= size
+
+
+_object_cache = None
+_object_cache_lock = threading.Lock()
+
+
+def get_object_cache() -> ObjectCache:
+    """Get the object cache shared by every provider."""
+    global _object_cache
+
+    with _object_cache_lock:
+        if not _object_cache:
+            _object_cache = ObjectCache()
+        return _object_cache
+
+
+class NegativeCache:
+    """
+    Remember searches that found nothing, so they are not sent again until their ttl passes.
+
+    Queries are matched case-insensitively, ignoring extra whitespace.
+    Entries are kept in the object cache so they survive restarts.
+    """
+
+    def __init__(self, object_cache: ObjectCache = None) -> None:
+        self.object_cache = object_cache or get_object_cache()
+
+    def _make_key(self, provider: str, kind: str, query: str, year=None) -> str:
+        query = " ".join(query.split()).lower()
+        return self.object_cache.make_key(provider, f"empty-{kind}", query, year or "")
+
+    def is_empty(self, provider: str, kind: str, query: str, year=None) -> bool:
+        """Check if a search is known to have no results."""
+        key = self._make_key(provider, kind, query, year)
+        return self.object_cache.get(key) is not None
+
+    def add(self, provider: str, kind: str, query: str, year=None, ttl: int = 3600):
+        """Remember that a search had no results for ttl seconds."""
+        key = self._make_key(provider, kind, query, year)
+        self.object_cache.set(key, True, ttl=ttl)
+
+
+_negative_cache = None
+_negative_cache_lock = threading.Lock()
+
+
+def get_negative_cache() -> NegativeCache:
+    """Get the negative search cache shared by every provider."""
+    global _negative_cache
+
+    with _negative_cache_lock:
+        if not _negative_cache:
+            _negative_cache = NegativeCache()
+        return _negative_cache
+
+
+class HTTPCache(SQLiteCache):
+    """
+    Store HTTP responses for every provider in a single sqlite database.
+
+    Responses are compressed, and the least recently used ones are removed once more than
+    max_size bytes are stored. Freed space is compacted once it passes a quarter of max_size.
+    WAL mode and a busy timeout let several running instances share the database.
+    Expired responses are kept until they are evicted so they can still be revalidated.
+    Access times are written at most every flush_interval seconds, and when the process exits.
+    """
+
+    def __init__(
+        self,
+        path: Path = None,
+        max_size: int = 512 * 1024 * 1024,
+        check_interval: int = 100,
+        flush_interval: int = 60,
+        busy_timeout: int = 30000,
+        **kwargs,
+    ) -> None:
+        if not path:
+            path = platformdirs.user_cache_path("video-preview").joinpath(
+                "metadata_cache.sqlite"
+            )
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(
+            path,
+            serializer=compressed_serializer,
+            wal=True,
+            busy_timeout=busy_timeout,
+            **kwargs,
+        )
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.flush_interval = flush_interval
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._saves = 0
+        # Access times waiting to be written, keyed by cache key
+        self._accessed = {}
+        self._flushed = time.time()
+        self._stats_lock = threading.Lock()
+
+        with self.responses.connection(commit=True) as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS accessed (key TEXT PRIMARY KEY, time REAL)"
+            )
+        self.evict()
+        atexit.register(self._flush_accessed)
+
+    def get_response(self, key: str, default=None):
+        response = super().get_response(key, default)
+        with self._stats_lock:
+            if response is default:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_read += len(response.content or b"")
+                self._accessed[key] = time.time()
+            flush = self._is_flush_due()
+        if flush:
+            self._flush_accessed()
+        return response
+
+    def save_response(self, response, cache_key: str = None, expires=None) -> None:
+        cache_key = cache_key or self.create_key(response.request)
+        super().save_response(response, cache_key, expires)
+        with self._stats_lock:
+            self.bytes_written += len(response.content or b"")
+            self._accessed[cache_key] = time.time()
+            self._saves += 1
+            check = self._saves % self.check_interval == 0
+            flush = self._is_flush_due()
+        if check:
+            self.evict()
+        elif flush:
+            self._flush_accessed()
+
+    def _is_flush_due(self) -> bool:
+        """Check if pending access times should be written. Call with _stats_lock held."""
+        return bool(self._accessed) and (
+            time.time() - self._flushed >= self.flush_interval
+            or len(self._accessed) >= self.check_interval
+        )
+
+    def _flush_accessed(self) -> None:
+        """Write pending access times, which are batched to avoid a write on every hit."""
+        with self._stats_lock:
+            accessed = list(self._accessed.items())
+            self._accessed = {}
+            self._flushed = time.time()
+        if not accessed:
+            return
+        with self.responses.connection(commit=True) as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO accessed VALUES (?, ?)", accessed
+            )
+
+    def size(self) -> int:
+        """Get the number of bytes stored in responses."""
+        with self.responses.connection() as connection:
+            (total,) = connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM responses"
+            ).fetchone()
+        return total
+
+    def evict(self) -> None:
+        """Remove the least recently used responses until under max_size, then compact."""
+        self._flush_accessed()
+        total = self.size()
+        if total > self.max_size:
+            with self.responses.connection() as connection:
+                rows = connection.execute(
+                    "SELECT responses.key, LENGTH(responses.value) FROM responses "
+                    "LEFT JOIN accessed ON accessed.key = responses.key "
+                    "ORDER BY COALESCE(accessed.time, 0)"
+                ).fetchall()
+            keys = []
+            for key, size in rows:
+                if total <= self.max_size:
+                    break
+                keys += [key]
+                total -= size
+            self.responses.bulk_delete(keys)
+            self._prune_redirects()
+
+        with self.responses.connection(commit=True) as connection:
+            connection.execute(
+                "DELETE FROM accessed WHERE key NOT IN (SELECT key FROM responses)"
+            )
+            (free_pages,) = connection.execute("PRAGMA freelist_count").fetchone()
+            (page_size,) = connection.execute("PRAGMA page_size").fetchone()
+        if free_pages * page_size > self.max_size // 4:
+            self.responses.vacuum()
+
+    def stats(self) -> dict:
+        """Get hit, miss and byte counts for this process, and the size of the cache."""
+        with self._stats_lock:
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+            }
+        stats["bytes_stored"] = self.size()
+        stats["responses"] = self.count()
+        return stats
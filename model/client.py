@@ -0,0 +1,420 @@
+import sys
+import copy
+import functools
+import json
+import re
+import threading
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+import requests_cache
+from requests_cache.cache_keys import create_key as _create_key
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+# Always import relative to *this* file's parent directory
+sys.path.append(Path(__file__).parent.as_posix())
+from cache import HTTPCache
+from ratelimit import QuotaExceededError
+
+# Seconds to wait for a provider before giving up on a request
+TIMEOUT = 60
+
+# Number of hosts to keep connection pools for and connections kept per host
+# Every provider may have several searches and hydrations running at the same time
+POOL_HOSTS = 16
+POOL_SIZE = 16
+
+# Retry idempotent requests that were rate limited or failed on the server side
+RETRY_TOTAL = 5
+RETRY_BACKOFF = 0.5
+RETRY_JITTER = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Bytes of HTTP responses to keep before the least recently used ones are removed
+CACHE_MAX_SIZE = 512 * 1024 * 1024
+
+# Cache lifetimes in seconds
+# Expired responses with an ETag or Last-Modified header are revalidated by requests_cache,
+# so a refresh usually costs a 304 instead of the full payload
+EXPIRE_SHORT = DAY
+EXPIRE_DEFAULT = 7 * DAY
+EXPIRE_LONG = 180 * DAY
+EXPIRE_STATIC = 365 * DAY
+
+# Cache lifetimes by provider and endpoint. The first matching pattern is used.
+EXPIRATION = {
+    # Search results change as new shows and movies are added
+    "api.themoviedb.org/3/search/*": EXPIRE_SHORT,
+    "api4.thetvdb.com/v4/search": EXPIRE_SHORT,
+    "api.tvmaze.com/search/*": EXPIRE_SHORT,
+    re.compile(r"omdbapi\.com/\?(.*&)?s="): EXPIRE_SHORT,
+    # Reference tables almost never change
+    "api.themoviedb.org/3/genre/*": EXPIRE_STATIC,
+    # Images are never changed once published
+    "image.tmdb.org/*": EXPIRE_STATIC,
+    "artworks.thetvdb.com/*": EXPIRE_STATIC,
+    "static.tvmaze.com/*": EXPIRE_STATIC,
+    "assets.fanart.tv/*": EXPIRE_STATIC,
+    "m.media-amazon.com/*": EXPIRE_STATIC,
+    # Artwork lists grow while a show is popular
+    "webservice.fanart.tv/*": EXPIRE_DEFAULT,
+    # Details of a show change while it is airing
+    "api.themoviedb.org/3/*": EXPIRE_DEFAULT,
+    "api4.thetvdb.com/v4/*": EXPIRE_DEFAULT,
+    "api.tvmaze.com/*": EXPIRE_DEFAULT,
+    "www.omdbapi.com/*": EXPIRE_DEFAULT,
+}
+
+# Statuses of series that will not get any new episodes
+ENDED_STATUSES = ("ended", "canceled", "cancelled")
+
+
+def get_expiration(status: str) -> int:
+    """
+    Get the cache lifetime for seasons and episodes of a series with the given status.
+
+    Seasons of ended series are kept much longer than those of series still airing.
+    """
+    if status and status.strip().lower() in ENDED_STATUSES:
+        return EXPIRE_LONG
+    return EXPIRE_SHORT
+
+
+# How cached responses are used, see configure()
+CACHE_MODE = {
+    # Return expired responses immediately and refresh them in the background
+    "stale_while_revalidate": False,
+    # Answer only from the cache and never send a request
+    "offline": False,
+}
+
+
+def configure(stale_while_revalidate: bool = None, offline: bool = None) -> None:
+    """
+    Set how cached responses are used by every provider.
+
+    This should be called before any request is made, but the shared session is updated as well.
+    Expired responses are also used when a request fails in either mode.
+    """
+    if stale_while_revalidate is not None:
+        CACHE_MODE["stale_while_revalidate"] = stale_while_revalidate
+    if offline is not None:
+        CACHE_MODE["offline"] = offline
+
+    with _session_lock:
+        if _session:
+            _apply_cache_mode(_session)
+
+
+def is_offline() -> bool:
+    """Check if requests are only answered from the cache, for every thread or just this one."""
+    return CACHE_MODE["offline"] or getattr(_local, "cache_only", False)
+
+
+def _apply_cache_mode(session: requests_cache.CachedSession) -> None:
+    session.settings.stale_while_revalidate = CACHE_MODE["stale_while_revalidate"]
+    session.settings.only_if_cached = CACHE_MODE["offline"]
+    session.settings.stale_if_error = (
+        CACHE_MODE["stale_while_revalidate"] or CACHE_MODE["offline"]
+    )
+
+
+def is_cache_miss(response) -> bool:
+    """Check for the empty 504 response returned in offline mode when nothing is cached."""
+    return is_offline() and response.status_code == 504
+
+
+def read_json(response):
+    """Parse a JSON response. Requests that could not be answered offline are empty."""
+    if is_cache_miss(response):
+        return {}
+    return json.loads(response.text)
+
+
+# Credentials are left out of cache keys and are not stored with cached responses
+SECRET_PARAMETERS = ["apikey", "api_key", "client_key", "Authorization"]
+
+# Query parameters holding free text searches, which are matched case-insensitively
+SEARCH_PARAMETERS = ("query", "q", "s")
+
+
+def _normalize_search(request):
+    """Get a copy of the request with search queries lowercased and trimmed."""
+    url = urlsplit(request.url)
+    params = parse_qsl(url.query, keep_blank_values=True)
+
+    normalized = []
+    for key, value in params:
+        if key in SEARCH_PARAMETERS:
+            value = " ".join(value.split()).lower()
+        normalized += [(key, value)]
+
+    if normalized == params:
+        return request
+
+    request = copy.copy(request)
+    request.url = urlunsplit(url._replace(query=urlencode(normalized)))
+    return request
+
+
+def create_key(request, **kwargs) -> str:
+    """
+    Create a cache key that can be shared between users and machines.
+
+    Credentials are already removed by ignored_parameters.
+    Parameter order is normalized by requests_cache, and search queries are normalized here.
+    """
+    return _create_key(_normalize_search(request), **kwargs)
+
+
+class LimitedRetry(Retry):
+    """
+    Count every retried attempt against the limiter of the request being sent.
+
+    urllib3 retries inside a single session.get(), so get_json only sees the last attempt.
+    Each retry waits for the rate limit, and retrying stops once the daily quota is used up.
+    """
+
+    def increment(
+        self,
+        method=None,
+        url=None,
+        response=None,
+        error=None,
+        _pool=None,
+        _stacktrace=None,
+    ):
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        limiter = getattr(_local, "limiter", None)
+        if limiter:
+            # The failed attempt was answered by the provider, so it used up a request
+            if response is not None:
+                limiter.record(response)
+            try:
+                limiter.acquire()
+            except QuotaExceededError as quota_error:
+                raise MaxRetryError(_pool, url, quota_error) from quota_error
+        return retry
+
+
+def _new_retry() -> Retry:
+    """
+    Retry GET requests with jittered exponential backoff.
+
+    Retry-After is respected for 429 and 503 responses.
+    Retries are counted against the limiter passed to get_json.
+    """
+    return LimitedRetry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        backoff_jitter=RETRY_JITTER,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def new_session(
+    cache_path: Path = None,
+    expiration: int = EXPIRE_DEFAULT,
+    timeout: int = TIMEOUT,
+    max_size: int = CACHE_MAX_SIZE,
+) -> requests_cache.CachedSession:
+    """
+    Create a cached session with pooled connections and retries.
+
+    Only successful responses are cached, in an HTTPCache at cache_path
+    that keeps at most max_size bytes.
+    Cache keys do not include credentials, so the cache survives key rotation.
+    Cache lifetimes are taken from EXPIRATION, or expiration if no pattern matches.
+    Requests can also pass expire_after to override both.
+    Stale and offline behaviour follows CACHE_MODE.
+    """
+    session = requests_cache.CachedSession(
+        backend=HTTPCache(cache_path, max_size=max_size),
+        expire_after=expiration,
+        urls_expire_after=EXPIRATION,
+        allowable_codes=(200,),
+        ignored_parameters=SECRET_PARAMETERS,
+        key_fn=create_key,
+    )
+    _apply_cache_mode(session)
+
+    adapter = HTTPAdapter(
+        pool_connections=POOL_HOSTS,
+        pool_maxsize=POOL_SIZE,
+        max_retries=_new_retry(),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    session.request = functools.partial(session.request, timeout=timeout)
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(max_size: int = CACHE_MAX_SIZE) -> requests_cache.CachedSession:
+    """
+    Get the session shared by every provider.
+
+    max_size only applies to the first call, which creates the session.
+    """
+    global _session
+
+    with _session_lock:
+        if not _session:
+            _session = new_session(max_size=max_size)
+        return _session
+
+
+class SingleFlight:
+    """
+    Share one call between threads that ask for the same key at the same time.
+
+    The first caller runs the function, and everyone else waits for its result or exception.
+    coalesced counts the calls that were answered by another caller.
+    """
+
+    def __init__(self) -> None:
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            if key in self._calls:
+                call = self._calls[key]
+                self.coalesced += 1
+                leader = False
+            else:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call["done"].wait()
+            if call["error"]:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = function()
+        except Exception as error:
+            call["error"] = error
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key)
+            call["done"].set()
+        return call["result"]
+
+
+_flights = SingleFlight()
+
+
+class CancelledError(Exception):
+    """Raised in a thread whose cancel token was cancelled before a request was sent."""
+
+
+class CancelToken:
+    """A flag that tells requests made by a superseded search to stop."""
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+_local = threading.local()
+
+
+def set_cancel_token(token: CancelToken = None) -> None:
+    """Set the cancel token checked by every request made from the current thread."""
+    _local.token = token
+
+
+def set_cache_only(cache_only: bool = False) -> None:
+    """Answer every request made from the current thread only from the cache, as if offline."""
+    _local.cache_only = cache_only
+
+
+def check_cancelled() -> None:
+    """Raise CancelledError if the current thread's cancel token was cancelled."""
+    token = getattr(_local, "token", None)
+    if token and token.is_cancelled():
+        raise CancelledError()
+
+
+def is_fresh(session, request) -> bool:
+    """Check if the cache can answer a request without contacting the provider."""
+    cache = getattr(session, "cache", None)
+    if cache is None:
+        return False
+    try:
+        # Read the stored response directly, so the check is not counted as a cache hit
+        response = cache.responses.get(cache.create_key(request))
+    except Exception:
+        return False
+    return response is not None and not response.is_expired
+
+
+def get_json(session, url: str, limiter=None, params={}, headers={}, **kwargs):
+    """
+    GET a JSON response, sharing one request between identical concurrent calls.
+
+    Requests are identical if they have the same cache key, so credentials are ignored.
+    The limiter is only used by the call that actually sends the request,
+    and not at all if the response is fresh in the cache.
+    The parsed result is shared, so it must not be modified.
+    Raises CancelledError if the thread's cancel token is cancelled before the request is sent.
+    In offline mode, or with set_cache_only(), nothing is sent and cache misses are empty.
+    """
+    request = requests.Request("GET", url, params=params, headers=headers).prepare()
+    key = create_key(request, ignored_parameters=SECRET_PARAMETERS)
+    offline = is_offline()
+    if offline:
+        kwargs["only_if_cached"] = True
+
+    def fetch():
+        # Only requests that reach the provider use up its rate limit and quota
+        if limiter and not offline and not is_fresh(session, request):
+            limiter.acquire()
+        # Waiting for the limiter can take a while, so check again before sending
+        check_cancelled()
+        # Retries made by the adapter are counted by LimitedRetry
+        _local.limiter = None if offline else limiter
+        try:
+            response = session.get(url, params=params, headers=headers, **kwargs)
+        finally:
+            _local.limiter = None
+        if limiter:
+            limiter.record(response)
+        return read_json(response)
+
+    while True:
+        check_cancelled()
+        try:
+            # Cache-only calls must not hand their misses to calls that may send a request
+            return _flights.do((key, offline), fetch)
+        except CancelledError:
+            # Only retry if the shared request was cancelled by another caller
+            check_cancelled()
+
+
+def coalesced_count() -> int:
+    """Get the number of requests that shared another request's response."""
+    return _flights.coalesced
@@ -1,17 +1,16 @@
 import sys
-import json
-import requests
-import requests_cache
 from pathlib import Path
 
-import functools
-
 # Always import relative to *this* file's parent directory
 sys.path.append(Path(__file__).parent.as_posix())
+from client import get_json, get_session, is_offline
+from ratelimit import get_limiter
 from metadata import Artwork, SeriesArtwork, MovieArtwork
 
 
 class MetadataDownloader:
+    source = "fanarttv"
+
     def __init__(
         self,
         project_keyfile: str = "FANARTTV_PROJECT_API_KEY",
@@ -21,7 +20,7 @@ class MetadataDownloader:
         self.project_key = None
         self.session = None
         self.genres = {}
-        self.timeout = 60
+        self.limiter = get_limiter(self.source)
         self._load_apikey(project_keyfile, keyfile)
 
     def _load_apikey(self, project_keyfile, keyfile):
@@ -48,24 +47,11 @@ class MetadataDownloader:
             case _:
                 return type
 
-    def _new_session(
-        self, cache_name: str = "metadata_cache", expiration: int = 3600 * 24 * 30
-    ):
-        requests_cache.install_cache(
-            cache_name=cache_name,
-            backend="sqlite",
-            expire_after=expiration,
-        )
-        self.session = requests.Session()
-        self.session.request = functools.partial(
-            self.session.request, timeout=self.timeout
-        )
-
     def _get_fanart(self, endpoint, params={}):
         url = f"http://webservice.fanart.tv/v3/{endpoint}"
 
         if not self.session:
-            self._new_session()
+            self.session = get_session()
 
         headers = {
             "accept": "application/json",
@@ -73,9 +59,17 @@ class MetadataDownloader:
         params["client_key"] = self.client_key
         params["api_key"] = self.project_key
 
-        response = self.session.get(url, headers=headers, params=params)
+        return get_json(self.session, url, self.limiter, params=params, headers=headers)
+
+    def remaining(self) -> int | None:
+        """
+        Get the number of requests left today, or None if there is no daily limit.
 
-        return json.loads(response.text)
+        There is no limit in offline mode because no requests are sent.
+        """
+        if is_offline():
+            return None
+        return self.limiter.remaining()
 
     def _get_fanart_series(self, series_id: int | str):
         endpoint = f"tv/{series_id}"
@@ -0,0 +1,266 @@
+import sys
+import copy
+import pickle
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+
+import platformdirs
+
+# Always import relative to *this* file's parent directory
+sys.path.append(Path(__file__).parent.as_posix())
+from metadata import Series, Episode, Movie
+
+# Providers that identify media by another provider's id
+SOURCE_IDS = {"omdb": "imdb"}
+
+
+class MediaIndex:
+    """
+    Full-text index of every series, movie and episode fetched from a provider.
+
+    Names, original names, years and external ids of series and movies are searchable,
+    along with episode titles. Search results are stubs that can be hydrated like
+    any other search result, so local results can be shown before the providers answer.
+    """
+
+    def __init__(self, path: Path = None) -> None:
+        if not path:
+            path = platformdirs.user_cache_path("video-preview").joinpath(
+                "index.sqlite"
+            )
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS media (
+                    id INTEGER PRIMARY KEY, key TEXT UNIQUE, source TEXT, kind TEXT,
+                    name TEXT, original_name TEXT, year TEXT, ids TEXT, stub BLOB
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(
+                    name, original_name, year, ids, content='media', content_rowid='id'
+                );
+                CREATE TRIGGER IF NOT EXISTS media_insert AFTER INSERT ON media BEGIN
+                    INSERT INTO media_fts (rowid, name, original_name, year, ids)
+                    VALUES (new.id, new.name, new.original_name, new.year, new.ids);
+                END;
+                CREATE TRIGGER IF NOT EXISTS media_delete AFTER DELETE ON media BEGIN
+                    INSERT INTO media_fts (media_fts, rowid, name, original_name, year, ids)
+                    VALUES ('delete', old.id, old.name, old.original_name, old.year, old.ids);
+                END;
+                CREATE TRIGGER IF NOT EXISTS media_update AFTER UPDATE ON media BEGIN
+                    INSERT INTO media_fts (media_fts, rowid, name, original_name, year, ids)
+                    VALUES ('delete', old.id, old.name, old.original_name, old.year, old.ids);
+                    INSERT INTO media_fts (rowid, name, original_name, year, ids)
+                    VALUES (new.id, new.name, new.original_name, new.year, new.ids);
+                END;
+
+                CREATE TABLE IF NOT EXISTS episodes (
+                    id INTEGER PRIMARY KEY, media_key TEXT, season_number INTEGER,
+                    number INTEGER, name TEXT, ids TEXT
+                );
+                CREATE INDEX IF NOT EXISTS episodes_media ON episodes (media_key);
+                CREATE VIRTUAL TABLE IF NOT EXISTS episodes_fts USING fts5(
+                    name, content='episodes', content_rowid='id'
+                );
+                CREATE TRIGGER IF NOT EXISTS episodes_insert AFTER INSERT ON episodes BEGIN
+                    INSERT INTO episodes_fts (rowid, name) VALUES (new.id, new.name);
+                END;
+                CREATE TRIGGER IF NOT EXISTS episodes_delete AFTER DELETE ON episodes BEGIN
+                    INSERT INTO episodes_fts (episodes_fts, rowid, name)
+                    VALUES ('delete', old.id, old.name);
+                END;
+                """)
+
+    @staticmethod
+    def _kind(media: Series | Movie) -> str:
+        return "movie" if isinstance(media, Movie) else "series"
+
+    @staticmethod
+    def _get_id(media: Series | Movie):
+        """Get the id the source provider uses for the media, or None."""
+        return media.ids.get(SOURCE_IDS.get(media.source, media.source))
+
+    @staticmethod
+    def _make_key(media: Series | Movie) -> str:
+        return f"{media.source}:{MediaIndex._kind(media)}:{MediaIndex._get_id(media)}"
+
+    @staticmethod
+    def _ids_text(ids: dict) -> str:
+        return " ".join(str(value) for value in ids.values())
+
+    @staticmethod
+    def _match(query: str) -> str:
+        """Turn free text into an FTS query where every word must match as a prefix."""
+        words = query.replace('"', " ").split()
+        return " ".join(f'"{word}"*' for word in words)
+
+    @staticmethod
+    def _year_text(year) -> str:
+        """Get the year as text. Providers set it as an int or a string, and -1 if unknown."""
+        try:
+            year = int(year)
+        except (TypeError, ValueError):
+            return ""
+        return str(year) if year > 0 else ""
+
+    def add(self, media: Series | Movie, replace: bool = True) -> None:
+        """
+        Add or update a series or movie, along with any episodes it has.
+
+        With replace set to False, media that is already indexed is left as is.
+        This keeps search stubs from replacing hydrated media, which has more external ids.
+        The index is only a shortcut, so failing to update it never fails a search or hydrate.
+        """
+        try:
+            self._add(media, replace)
+        except Exception as error:
+            print(f"Indexing {media.name} failed: {error}")
+
+    def _add(self, media: Series | Movie, replace: bool) -> None:
+        if not media.source or not self._get_id(media) or not media.name:
+            return
+
+        key = self._make_key(media)
+        stub = copy.copy(media)
+        if isinstance(media, Series):
+            stub.seasons = {}
+        data = zlib.compress(pickle.dumps(stub, protocol=pickle.HIGHEST_PROTOCOL))
+        year = self._year_text(media.year)
+
+        episodes = []
+        if isinstance(media, Series):
+            for season in media.seasons.values():
+                for episode in season.episodes.values():
+                    if episode.name:
+                        episodes += [
+                            (
+                                key,
+                                episode.season_number,
+                                episode.number,
+                                episode.name,
+                                self._ids_text(episode.ids),
+                            )
+                        ]
+
+        conflict = "NOTHING"
+        if replace:
+            conflict = (
+                "UPDATE SET name = excluded.name, "
+                "original_name = excluded.original_name, year = excluded.year, "
+                "ids = excluded.ids, stub = excluded.stub"
+            )
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO media "
+                "(key, source, kind, name, original_name, year, ids, stub) "
+                f"VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO {conflict}",
+                (
+                    key,
+                    media.source,
+                    self._kind(media),
+                    media.name,
+                    media.original_name,
+                    year,
+                    self._ids_text(media.ids),
+                    data,
+                ),
+            )
+
+            # Stubs from a search have no seasons, so keep the episodes already indexed
+            if episodes:
+                self._connection.execute(
+                    "DELETE FROM episodes WHERE media_key = ?", (key,)
+                )
+                self._connection.executemany(
+                    "INSERT INTO episodes "
+                    "(media_key, season_number, number, name, ids) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    episodes,
+                )
+
+    def add_all(self, all_media: list[Series | Movie], replace: bool = True) -> None:
+        for media in all_media:
+            self.add(media, replace)
+
+    def _load(self, data: bytes) -> Series | Movie | None:
+        try:
+            return pickle.loads(zlib.decompress(data))
+        except Exception:
+            # Stubs written by an older version of the models may not load
+            return None
+
+    def search(self, query: str, kind: str = None, limit: int = 20) -> list:
+        """Search names, original names, years and ids, returning the best matches first."""
+        match = self._match(query)
+        if not match:
+            return []
+
+        sql = (
+            "SELECT media.stub FROM media_fts "
+            "JOIN media ON media.id = media_fts.rowid "
+            "WHERE media_fts MATCH ?"
+        )
+        params = [match]
+        if kind:
+            sql += " AND media.kind = ?"
+            params += [kind]
+        sql += " ORDER BY bm25(media_fts) LIMIT ?"
+        params += [limit]
+
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+
+        results = [self._load(data) for (data,) in rows]
+        return [media for media in results if media]
+
+    def search_episodes(self, query: str, limit: int = 20) -> list[tuple]:
+        """Search episode titles, returning (series stub, episode) pairs."""
+        match = self._match(query)
+        if not match:
+            return []
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT media.stub, episodes.season_number, episodes.number, "
+                "episodes.name FROM episodes_fts "
+                "JOIN episodes ON episodes.id = episodes_fts.rowid "
+                "JOIN media ON media.key = episodes.media_key "
+                "WHERE episodes_fts MATCH ? ORDER BY bm25(episodes_fts) LIMIT ?",
+                (match, limit),
+            ).fetchall()
+
+        results = []
+        for data, season_number, number, name in rows:
+            series = self._load(data)
+            if not series:
+                continue
+            episode = Episode()
+            episode.series_name = series.name
+            episode.season_number = season_number
+            episode.number = number
+            episode.name = name
+            results += [(series, episode)]
+        return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_media_index() -> MediaIndex:
+    """Get the index shared by every provider."""
+    global _index
+
+    with _index_lock:
+        if not _index:
+            _index = MediaIndex()
+        return _index
@@ -1,9 +1,15 @@
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass, field
 from typing import ClassVar
 from functools import total_ordering
 from pathlib import Path
+import sys
+import threading
 import requests
-import requests_cache
+
+# Always import relative to *this* file's parent directory
+sys.path.append(Path(__file__).parent.as_posix())
+from client import get_session, is_cache_miss
 
 
 @total_ordering
@@ -36,16 +42,6 @@ class Artwork:
     type: str = ""
     session: requests.Session = None
 
-    def _new_session(
-        self, cache_name: str = "metadata_cache", expiration: int = 3600 * 24 * 30
-    ):
-        requests_cache.install_cache(
-            cache_name=cache_name,
-            backend="sqlite",
-            expire_after=expiration,
-        )
-        self.session = requests.Session()
-
     def is_valid(self) -> bool:
         if self.ids and self.url and self.type in Artwork.TYPES:
             return True
@@ -66,7 +62,7 @@ class Artwork:
             filename = f"{Path(filename).stem}{suffix}"
 
         if not self.session:
-            self._new_session()
+            self.session = get_session()
 
         image = directory.joinpath(filename)
 
@@ -74,6 +70,9 @@ class Artwork:
             return
 
         with self.session.get(self.url, stream=True) as response:
+            # Images that were never downloaded are skipped in offline mode
+            if is_cache_miss(response):
+                return None
             response.raise_for_status()
 
             with open(image, "wb") as file:
@@ -176,16 +175,46 @@ class MovieArtwork(ArtworkGroup):
         return []
 
 
-@dataclass
+@dataclass(slots=True)
 class Network:
     id: int = -1
     logo_path: str = ""
     name: str = ""
     origin_country: str = ""
 
+    # Shared instances keyed by every field
+    _interned: ClassVar[dict] = {}
+    _interned_lock: ClassVar[threading.Lock] = threading.Lock()
 
-@dataclass
+    @classmethod
+    def intern(cls, network: "Network") -> "Network":
+        """
+        Get the shared instance equal to network.
+
+        The same few networks are listed by thousands of series, so only one of each is kept.
+        Shared instances must not be modified.
+        """
+        key = (network.id, network.logo_path, network.name, network.origin_country)
+        with cls._interned_lock:
+            return cls._interned.setdefault(key, network)
+
+    def __reduce__(self):
+        # Copies and unpickled networks are shared instances too
+        return (
+            _intern_network,
+            (self.id, self.logo_path, self.name, self.origin_country),
+        )
+
+
+def _intern_network(*fields) -> Network:
+    return Network.intern(Network(*fields))
+
+
+@dataclass(slots=True)
 class Episode:
+    # Strings repeated by every episode of a series are interned, so only one copy is kept
+    _interned_fields: ClassVar[frozenset] = frozenset({"series_name", "type"})
+
     ids: dict = field(default_factory=dict[str, int])
     series_id: int = -1
     number: int = -1
@@ -196,6 +225,15 @@ class Episode:
     type: str = ""
     still_path: str = ""
     series_name: str = ""
+    # False if details like the overview still need to be fetched from the provider
+    hydrated: bool = True
+    # First air date as YYYY-MM-DD
+    air_date: str = ""
+
+    def __setattr__(self, name, value):
+        if type(value) is str and name in self._interned_fields:
+            value = sys.intern(value)
+        object.__setattr__(self, name, value)
 
     def is_valid(self) -> bool:
         if (
@@ -218,8 +256,10 @@ class Episode:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class Season:
+    _interned_fields: ClassVar[frozenset] = frozenset({"series_name"})
+
     ids: dict = field(default_factory=dict[str, int])
     number: int = -1
     episodes: dict = field(default_factory=dict[int, Episode])
@@ -228,6 +268,11 @@ class Season:
     overview: str = ""
     poster_path: str = ""
 
+    def __setattr__(self, name, value):
+        if type(value) is str and name in self._interned_fields:
+            value = sys.intern(value)
+        object.__setattr__(self, name, value)
+
     def is_valid(self) -> bool:
         if self.ids and self.number and self.episodes and self.series_name:
             return True
@@ -240,6 +285,65 @@ class Season:
         return None
 
 
+class EpisodeIndex:
+    """
+    Sorted lookups over the episodes of a series.
+
+    Episodes are referred to by (season number, episode number) keys and looked up in the series.
+    Regular episodes are numbered absolutely across seasons and linked to the next and previous
+    episode, moving on to the next season after the last episode of a season.
+    Specials are linked among themselves and have no absolute number.
+    """
+
+    def __init__(self, seasons: dict[int, Season]) -> None:
+        self.sizes = self._get_sizes(seasons)
+        self.season_numbers = sorted(seasons)
+        self.episode_numbers = {}
+        self.rows = {}
+        self.absolute = []
+        self.absolute_numbers = {}
+        self.next = {}
+        self.previous = {}
+
+        specials = []
+        dated = []
+        for season_number in self.season_numbers:
+            episodes = seasons[season_number].episodes
+            numbers = sorted(episodes)
+            self.episode_numbers[season_number] = numbers
+
+            keys = [(season_number, number) for number in numbers]
+            for row, key in enumerate(keys):
+                self.rows[key] = row
+                if episodes[key[1]].air_date:
+                    dated += [(episodes[key[1]].air_date, key)]
+
+            if season_number == 0:
+                specials += keys
+            else:
+                self.absolute += keys
+
+        for chain in (specials, self.absolute):
+            for previous, following in zip(chain, chain[1:]):
+                self.next[previous] = following
+                self.previous[following] = previous
+
+        for number, key in enumerate(self.absolute, 1):
+            self.absolute_numbers[key] = number
+
+        dated.sort()
+        self.air_dates = [air_date for air_date, _ in dated]
+        self.air_date_keys = [key for _, key in dated]
+
+    @staticmethod
+    def _get_sizes(seasons: dict[int, Season]) -> dict[int, int]:
+        return {number: len(season.episodes) for number, season in seasons.items()}
+
+    def is_current(self, seasons: dict[int, Season]) -> bool:
+        """Check if no seasons or episodes were added or removed since the index was built."""
+        return self.sizes == self._get_sizes(seasons)
+
+
 @dataclass
 class Series:
     ids: dict = field(default_factory=dict[str, int])
@@ -249,17 +353,33 @@ class Series:
     overview: str = ""
     air_date: str = ""
     year: int = -1
+    # As given by the provider, e.g. "Ended" or "Returning Series"
+    status: str = ""
     genres: list = field(default_factory=list[str])
     networks: list = field(default_factory=list[Network])
     poster_path: str = ""
     backdrop_path: str = ""
     source: str = ""
+    # Built by build_index() and rebuilt when seasons or episodes are added or removed
+    _index: EpisodeIndex = field(default=None, init=False, repr=False, compare=False)
+
+    def __getstate__(self):
+        # The index is cheaper to rebuild than to store
+        state = self.__dict__.copy()
+        state.pop("_index", None)
+        return state
 
     def is_valid(self) -> bool:
         if self.ids and self.seasons and self.name and self.year and self.source:
             return True
         return False
 
+    def is_valid_stub(self) -> bool:
+        """Check if this is usable as a search result that has not been hydrated yet."""
+        if self.ids and self.name and self.source:
+            return True
+        return False
+
     def get_season(self, season_number: int):
         if season_number in self.seasons:
             return self.seasons[season_number]
@@ -273,6 +393,65 @@ class Series:
             return season.episodes[episode_number]
         return None
 
+    def build_index(self) -> None:
+        """Build the sorted episode indexes used for navigation and lookups."""
+        self._index = EpisodeIndex(self.seasons)
+
+    def _get_index(self) -> EpisodeIndex:
+        if not self._index or not self._index.is_current(self.seasons):
+            self.build_index()
+        return self._index
+
+    def _get_episode(self, key) -> Episode | None:
+        if not key:
+            return None
+        return self.get_episode(*key)
+
+    def get_season_numbers(self) -> list[int]:
+        """Get the season numbers in order."""
+        return self._get_index().season_numbers
+
+    def get_episodes(self, season_number: int) -> list[Episode]:
+        """Get the episodes of a season in order."""
+        index = self._get_index()
+        if season_number not in index.episode_numbers:
+            return []
+        episodes = self.seasons[season_number].episodes
+        return [episodes[number] for number in index.episode_numbers[season_number]]
+
+    def get_row(self, season_number: int, episode_number: int) -> int | None:
+        """Get the position of an episode in its season's ordered episodes."""
+        return self._get_index().rows.get((season_number, episode_number))
+
+    def get_next_episode(self, episode: Episode) -> Episode | None:
+        """Get the episode after the given one, which may be in the next season."""
+        key = (episode.season_number, episode.number)
+        return self._get_episode(self._get_index().next.get(key))
+
+    def get_previous_episode(self, episode: Episode) -> Episode | None:
+        """Get the episode before the given one, which may be in the previous season."""
+        key = (episode.season_number, episode.number)
+        return self._get_episode(self._get_index().previous.get(key))
+
+    def get_absolute_number(self, episode: Episode) -> int | None:
+        """Get the number of an episode counted from the first episode of the series."""
+        key = (episode.season_number, episode.number)
+        return self._get_index().absolute_numbers.get(key)
+
+    def get_absolute_episode(self, absolute_number: int) -> Episode | None:
+        """Get an episode by its number counted from the first episode of the series."""
+        index = self._get_index()
+        if 0 < absolute_number <= len(index.absolute):
+            return self._get_episode(index.absolute[absolute_number - 1])
+        return None
+
+    def get_episodes_by_air_date(self, air_date: str) -> list[Episode]:
+        """Get the episodes first aired on a date, given as YYYY-MM-DD."""
+        index = self._get_index()
+        start = bisect_left(index.air_dates, air_date)
+        end = bisect_right(index.air_dates, air_date, lo=start)
+        return [self._get_episode(key) for key in index.air_date_keys[start:end]]
+
 
 @dataclass
 class Movie:
@@ -295,3 +474,63 @@ class Movie:
         if self.ids and self.name and self.year and self.source:
             return True
         return False
+
+    def is_valid_stub(self) -> bool:
+        """Check if this is usable as a search result that has not been hydrated yet."""
+        if self.ids and self.name and self.source:
+            return True
+        return False
+
+
+def _benchmark(series_count: int = 4, episode_count: int = 1000) -> None:
+    """
+    Compare the memory used per episode by the slotted Episode and a plain dataclass.
+
+    Each series stands in for one provider's copy of the same series,
+    with the series name and type parsed into new strings for every episode like a JSON response.
+    """
+    import dataclasses
+    import tracemalloc
+
+    PlainEpisode = dataclasses.make_dataclass(
+        "PlainEpisode",
+        [
+            (
+                f.name,
+                f.type,
+                dataclasses.field(default=f.default, default_factory=f.default_factory),
+            )
+            for f in dataclasses.fields(Episode)
+        ],
+    )
+
+    def measure(episode_class) -> float:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        episodes = []
+        for provider in range(series_count):
+            for number in range(episode_count):
+                episodes += [
+                    episode_class(
+                        ids={"tmdb": provider * episode_count + number},
+                        series_id=provider,
+                        number=number,
+                        season_number=1,
+                        name=f"Episode {number}",
+                        type="".join(["stan", "dard"]),
+                        series_name="".join(["Series ", "Name"]),
+                    )
+                ]
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return used / len(episodes)
+
+    plain = measure(PlainEpisode)
+    slotted = measure(Episode)
+    print(f"{series_count * episode_count} episodes")
+    print(f"dataclass: {plain:.0f} bytes per episode")
+    print(f"slotted:   {slotted:.0f} bytes per episode ({slotted / plain:.0%})")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -1,58 +1,61 @@
 import sys
-import json
 import calendar
-import requests
-import requests_cache
 from pathlib import Path
 
-import functools
-
-
 # Always import relative to *this* file's parent directory
 sys.path.append(Path(__file__).parent.as_posix())
+from cache import get_negative_cache, get_object_cache
+from client import get_expiration, get_json, get_session, is_offline
+from index import get_media_index
+from ratelimit import get_limiter
 from metadata import Series, Season, Episode, Movie
 
 
 class MetadataDownloader:
     """This class is a wrapper around the OMDB API to download metadata for series and episodes."""
 
+    source = "omdb"
+
+    # Searches without results are not repeated for a day, since OMDB has a small daily quota
+    negative_ttl = 3600 * 24
+
+    # Errors returned for searches that were answered but had nothing to show
+    empty_errors = {"Movie not found!", "Series not found!", "Too many results."}
+
     def __init__(self, keyfile="OMDB_API_KEY") -> None:
         self.apikey = None
         self.session = None
         self._month_abbrs = {
             name: num for num, name in enumerate(calendar.month_abbr) if num
         }
-        self.timeout = 60
+        self.limiter = get_limiter(self.source)
+        self.object_cache = get_object_cache()
+        self.negative_cache = get_negative_cache()
+        self.index = get_media_index()
+        # Build episodes from the season listing alone and fetch details only when needed
+        self.bulk_seasons = True
         self._load_apikey(keyfile=keyfile)
 
-    def _new_session(
-        self, cache_name: str = "metadata_cache", expiration: int = 3600 * 24 * 30
-    ):
-        requests_cache.install_cache(
-            cache_name=cache_name,
-            backend="sqlite",
-            expire_after=expiration,
-        )
-        self.session = requests.Session()
-        self.session.request = functools.partial(
-            self.session.request, timeout=self.timeout
-        )
-
     def _load_apikey(self, keyfile) -> None:
         with open(keyfile) as fn:
             self.apikey = fn.read().strip()
 
         if not self.session:
-            self._new_session()
+            self.session = get_session()
+
+    def _get_omdb(self, params={}, expire_after=None, errors: list = None):
+        """
+        Get a successful OMDB response, or {} if nothing was found or the request failed.
 
-    def _get_omdb(self, params={}):
+        If errors is given, the error message of a failed request is added to it.
+        """
         if not self.apikey:
             self._load_apikey()
 
         url = "http://www.omdbapi.com/"
 
         if not self.session:
-            self._new_session()
+            self.session = get_session()
 
         headers = {
             "accept": "application/json",
@@ -60,8 +63,14 @@ class MetadataDownloader:
 
         params["apikey"] = self.apikey
 
-        response = self.session.get(url, headers=headers, params=params)
-        raw_json = json.loads(response.text)
+        raw_json = get_json(
+            self.session,
+            url,
+            self.limiter,
+            params=params,
+            headers=headers,
+            expire_after=expire_after,
+        )
         if raw_json:
             if "totalResults" in raw_json:
                 if raw_json["totalResults"] == "0":
@@ -69,29 +78,82 @@ class MetadataDownloader:
             if "Response" in raw_json:
                 if raw_json["Response"] == "True":
                     return raw_json
+            if "Error" in raw_json and errors is not None:
+                errors += [raw_json["Error"]]
         return {}
 
-    def search_series(
-        self,
-        name: str,
-        year: int = None,
-        limit: int = 5,
-        allow_missing_episodes: bool = False,
-    ) -> list[Series]:
-        all_series = []
+    def remaining(self) -> int | None:
+        """
+        Get the number of requests left today, or None if there is no daily limit.
+
+        There is no limit in offline mode because no requests are sent.
+        """
+        if is_offline():
+            return None
+        return self.limiter.remaining()
+
+    def is_known_empty(self, name: str, year: int = None, kind: str = "series") -> bool:
+        """Check if a search is known to have no results, without sending any requests."""
+        return self.negative_cache.is_empty(self.source, kind, name, year)
+
+    def _set_empty(self, name: str, year: int = None, kind: str = "series") -> None:
+        """Remember that a search had no results. Offline cache misses are not remembered."""
+        if not is_offline():
+            self.negative_cache.add(
+                self.source, kind, name, year, ttl=self.negative_ttl
+            )
+
+    def _search(self, name: str, media_type: str, year: int = None, limit: int = 5):
+        all_results = []
 
-        params = {"s": name, "type": "series"}
+        if self.is_known_empty(name, year, media_type):
+            return all_results
+
+        params = {"s": name, "type": media_type}
         if year:
             params["y"] = year
 
-        results = self._get_omdb(params)
+        errors = []
+        results = self._get_omdb(params, errors=errors)
         if "Search" in results:
             if results["Search"] != "N/A":
-                all_series = results["Search"]
+                all_results = results["Search"]
+
+        # Only remember searches that OMDB answered, not ones refused for the key or quota
+        if not all_results and set(errors) & self.empty_errors:
+            self._set_empty(name, year, media_type)
 
-        if len(all_series) > limit:
-            all_series = all_series[0:limit]
+        if len(all_results) > limit:
+            all_results = all_results[0:limit]
 
+        return all_results
+
+    def search_series_stubs(
+        self, name: str, year: int = None, limit: int = 5
+    ) -> list[Series]:
+        """Search for series using only the search listing, without any extra requests."""
+        all_series = self._search(name, "series", year, limit)
+        results = [self._process_stub(Series(), result) for result in all_series]
+        self.index.add_all(results, replace=False)
+        return results
+
+    def search_movies_stubs(
+        self, name: str, year: int = None, limit: int = 5
+    ) -> list[Movie]:
+        """Search for movies using only the search listing, without any extra requests."""
+        all_movies = self._search(name, "movie", year, limit)
+        results = [self._process_stub(Movie(), result) for result in all_movies]
+        self.index.add_all(results, replace=False)
+        return results
+
+    def search_series(
+        self,
+        name: str,
+        year: int = None,
+        limit: int = 5,
+        allow_missing_episodes: bool = False,
+    ) -> list[Series]:
+        all_series = self._search(name, "series", year, limit)
         return self._process_series(all_series, allow_missing_episodes)
 
     def search_movies(
@@ -100,22 +162,51 @@ class MetadataDownloader:
         year: int = None,
         limit: int = 5,
     ) -> list[Movie]:
-        all_movies = []
-
-        params = {"s": name, "type": "movie"}
-        if year:
-            params["y"] = year
-
-        results = self._get_omdb(params)
-        if "Search" in results:
-            if results["Search"] != "N/A":
-                all_movies = results["Search"]
-
-        if len(all_movies) > limit:
-            all_movies = all_movies[0:limit]
-
+        all_movies = self._search(name, "movie", year, limit)
         return self._process_movies(all_movies)
 
+    def hydrate(
+        self,
+        media: Series | Movie,
+        allow_missing_episodes: bool = False,
+        on_progress=None,
+    ) -> Series | Movie:
+        """
+        Fetch the full details of a series or movie stub from OMDB.
+
+        If on_progress is given, it is called with the series as each season is merged.
+        Finished results are kept in the object cache.
+        """
+        kind = "movie" if isinstance(media, Movie) else "series"
+        ordering = "missing" if allow_missing_episodes else ""
+        key = self.object_cache.make_key(
+            self.source, kind, media.ids["imdb"], ordering=ordering
+        )
+        cached = self.object_cache.get(key)
+        if cached:
+            return cached
+
+        if isinstance(media, Movie):
+            s = self._get_movie(media.ids["imdb"])
+            media = self._process_details(media, s)
+        else:
+            s = self._get_series(media.ids["imdb"])
+            media = self._process_details(media, s)
+            media.status = self._get_status(s)
+            media = self._process_seasons(media, s, allow_missing_episodes, on_progress)
+
+        if isinstance(media, Series):
+            media.build_index()
+
+        if media.is_valid():
+            ttl = None
+            if isinstance(media, Series):
+                # Series still airing get new episodes, so they are kept for less time
+                ttl = get_expiration(media.status)
+            self.object_cache.set(key, media, ttl=ttl)
+            self.index.add(media)
+        return media
+
     def _get_series(self, series_id):
         params = {"i": series_id, "plot": "full"}
         return self._get_omdb(params)
@@ -132,14 +223,32 @@ class MetadataDownloader:
         }
         return self._get_omdb(params)
 
-    def _get_season(self, series_id: str, season_number: int):
+    def _get_episode_details(self, episode_id: str):
+        params = {"i": episode_id, "plot": "full"}
+        return self._get_omdb(params)
+
+    def _get_season(self, series_id: str, season_number: int, expire_after=None):
         params = {
             "i": series_id,
             "Season": season_number,
         }
-        return self._get_omdb(params)
-
-    def _process_seasons(self, series, data, allow_missing_episodes: bool = False):
+        return self._get_omdb(params, expire_after=expire_after)
+
+    def _get_status(self, data) -> str:
+        """
+        Get the status of a series from its years.
+
+        OMDB has no status, but a series that has ended lists its last year, e.g. "2005–2013".
+        """
+        if "Year" in data:
+            years = data["Year"].replace("-", "–").split("–")
+            if len(years) == 2 and years[1].strip():
+                return "ended"
+        return ""
+
+    def _process_seasons(
+        self, series, data, allow_missing_episodes: bool = False, on_progress=None
+    ):
         if "totalSeasons" not in data:
             return series
 
@@ -149,9 +258,12 @@ class MetadataDownloader:
         # Get total seasons so each can be requested
         total_seasons = int(data["totalSeasons"])
 
+        # Seasons of ended series are cached for longer than those still airing
+        expire_after = get_expiration(self._get_status(data))
+
         # Process each season
-        for season_number in range(1, int(total_seasons)):
-            s = self._get_season(series.ids["imdb"], season_number)
+        for season_number in range(1, total_seasons + 1):
+            s = self._get_season(series.ids["imdb"], season_number, expire_after)
 
             if "Season" not in s:
                 continue
@@ -182,7 +294,14 @@ class MetadataDownloader:
 
                 episode.number = int(e["Episode"])
 
-                e = self._get_episode(series.ids["imdb"], season.number, episode.number)
+                # The season listing only has the title and ids
+                # Plot and Poster are fetched later by hydrate_episode
+                if self.bulk_seasons:
+                    episode.hydrated = False
+                else:
+                    e = self._get_episode(
+                        series.ids["imdb"], season.number, episode.number
+                    )
 
                 episode.series_name = series.name
                 episode.season_number = season.number
@@ -193,12 +312,7 @@ class MetadataDownloader:
                 if "imdbID" in e:
                     if e["imdbID"] != "N/A":
                         episode.ids["imdb"] = e["imdbID"]
-                if "Plot" in e:
-                    if e["Plot"] != "N/A":
-                        episode.overview = e["Plot"].replace("\\'", "'")
-                if "Poster" in e:
-                    if e["Poster"] != "N/A":
-                        episode.still_path = e["Poster"]
+                self._process_episode_details(episode, e)
 
                 if episode.is_valid():
                     season.episodes[episode.number] = episode
@@ -211,52 +325,109 @@ class MetadataDownloader:
 
             if season.is_valid():
                 series.seasons[season.number] = season
+                if on_progress:
+                    on_progress(series)
 
         return series
 
+    def _process_stub(self, media: Series | Movie, result: dict) -> Series | Movie:
+        media.source = "omdb"
+
+        if "imdbID" in result:
+            if result["imdbID"] != "N/A":
+                media.ids["imdb"] = result["imdbID"]
+        if "Title" in result:
+            if result["Title"] != "N/A":
+                media.name = result["Title"]
+        if "Year" in result:
+            if result["Year"] != "N/A":
+                media.year = int(result["Year"][0:4])
+        if "Poster" in result:
+            if result["Poster"] != "N/A":
+                media.poster_path = result["Poster"]
+
+        return media
+
+    def _process_details(self, media: Series | Movie, s: dict) -> Series | Movie:
+        if "Title" in s:
+            if s["Title"] != "N/A":
+                media.name = s["Title"]
+        if "Year" in s:
+            if s["Year"] != "N/A":
+                media.year = int(s["Year"][0:4])
+        if "Released" in s:
+            if s["Released"] != "N/A":
+                media.air_date = self._process_date(s["Released"])
+        if "Genre" in s:
+            if s["Genre"] != "N/A":
+                genres = s["Genre"].split(",")
+                genres = [genre.strip() for genre in genres]
+                media.genres += genres
+        if "Plot" in s:
+            if s["Plot"] != "N/A":
+                media.overview = s["Plot"].replace("\\'", "'")
+        if "Poster" in s:
+            if s["Poster"] != "N/A":
+                media.poster_path = s["Poster"]
+
+        return media
+
+    def _process_date(self, date: str) -> str:
+        """
+        Convert an OMDB date to YYYY-MM-DD.
+
+        Details use dates like "20 Jan 2008", while season listings already use "2008-01-20".
+        """
+        parts = date.split()
+        if len(parts) != 3 or parts[1] not in self._month_abbrs:
+            return date
+        day, month, year = parts
+        return f"{year}-{self._month_abbrs[month]:02}-{int(day):02}"
+
+    def _process_episode_details(self, episode: Episode, e: dict) -> Episode:
+        if "Plot" in e:
+            if e["Plot"] != "N/A":
+                episode.overview = e["Plot"].replace("\\'", "'")
+        if "Poster" in e:
+            if e["Poster"] != "N/A":
+                episode.still_path = e["Poster"]
+        if "Released" in e:
+            if e["Released"] != "N/A":
+                episode.air_date = self._process_date(e["Released"])
+        return episode
+
+    def hydrate_episode(self, episode: Episode) -> Episode:
+        """
+        Fetch the plot and poster of an episode that was built from a season listing.
+
+        The episode is updated in place and returned.
+        It stays unhydrated if OMDB did not answer, so it is fetched again the next time.
+        """
+        if episode.hydrated:
+            return episode
+
+        # Without an id there is nothing to fetch
+        if "imdb" not in episode.ids:
+            episode.hydrated = True
+            return episode
+
+        e = self._get_episode_details(episode.ids["imdb"])
+        if e:
+            self._process_episode_details(episode, e)
+            episode.hydrated = True
+        return episode
+
     def _process_series(
         self, all_series: list[dict], allow_missing_episodes: bool = True
     ) -> list[Series]:
         processed_series = []
         for result in all_series:
-            series = Series()
-            series.source = "omdb"
+            series = self._process_stub(Series(), result)
 
-            if "imdbID" not in result:
+            if "imdb" not in series.ids:
                 continue
 
-            if result["imdbID"] == "N/A":
-                continue
-
-            series.ids["imdb"] = result["imdbID"]
-
-            s = self._get_series(series.ids["imdb"])
-
-            if "Title" in s:
-                if s["Title"] != "N/A":
-                    series.name = s["Title"]
-            if "Year" in s:
-                if s["Year"] != "N/A":
-                    series.year = int(s["Year"][0:4])
-            if "Released" in s:
-                if s["Released"] != "N/A":
-                    release_date = s["Released"]
-                    if release_date:
-                        day, month, year = release_date.split()
-                        series.air_date = f"{year}-{self._month_abbrs[month]}-{day}"
-            if "Genre" in s:
-                if s["Genre"] != "N/A":
-                    genres = s["Genre"].split(",")
-                    genres = [genre.strip() for genre in genres]
-                    series.genres += genres
-            if "Plot" in s:
-                if s["Plot"] != "N/A":
-                    series.overview = s["Plot"].replace("\\'", "'")
-            if "Poster" in s:
-                if s["Poster"] != "N/A":
-                    series.poster_path = s["Poster"]
-
-            series = self._process_seasons(series, s, allow_missing_episodes)
+            series = self.hydrate(series, allow_missing_episodes)
 
             if series.is_valid():
                 processed_series += [series]
@@ -266,42 +437,12 @@ class MetadataDownloader:
     def _process_movies(self, all_movies: list[dict]) -> list[Movie]:
         processed_movies = []
         for result in all_movies:
-            movie = Movie()
-            movie.source = "omdb"
-
-            if "imdbID" not in result:
-                continue
+            movie = self._process_stub(Movie(), result)
 
-            if result["imdbID"] == "N/A":
+            if "imdb" not in movie.ids:
                 continue
 
-            movie.ids["imdb"] = result["imdbID"]
-
-            s = self._get_movie(movie.ids["imdb"])
-
-            if "Title" in s:
-                if s["Title"] != "N/A":
-                    movie.name = s["Title"]
-            if "Year" in s:
-                if s["Year"] != "N/A":
-                    movie.year = int(s["Year"][0:4])
-            if "Released" in s:
-                if s["Released"] != "N/A":
-                    release_date = s["Released"]
-                    if release_date:
-                        day, month, year = release_date.split()
-                        movie.air_date = f"{year}-{self._month_abbrs[month]}-{day}"
-            if "Genre" in s:
-                if s["Genre"] != "N/A":
-                    genres = s["Genre"].split(",")
-                    genres = [genre.strip() for genre in genres]
-                    movie.genres += genres
-            if "Plot" in s:
-                if s["Plot"] != "N/A":
-                    movie.overview = s["Plot"].replace("\\'", "'")
-            if "Poster" in s:
-                if s["Poster"] != "N/A":
-                    movie.poster_path = s["Poster"]
+            movie = self.hydrate(movie)
 
             if movie.is_valid():
                 processed_movies += [movie]
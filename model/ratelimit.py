@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import platformdirs
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None
+
+# Requests per second, burst size and requests per day (None for no daily limit)
+LIMITS = {
+    "tmdb": {"rate": 40, "burst": 40, "daily_limit": None},
+    "tvdb": {"rate": 10, "burst": 10, "daily_limit": None},
+    "tvmaze": {"rate": 2, "burst": 20, "daily_limit": None},
+    "omdb": {"rate": 5, "burst": 5, "daily_limit": 1000},
+    "fanarttv": {"rate": 10, "burst": 10, "daily_limit": None},
+}
+
+
+class QuotaExceededError(Exception):
+    """Raised when a provider has no requests left for today."""
+
+
+class TokenBucket:
+    """A thread-safe token bucket that refills at rate tokens per second."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        """Block until a token is available, then take it."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class QuotaLedger:
+    """
+    Count requests per provider per day.
+
+    Counts are kept in a JSON file so they survive restarts.
+    The file is re-read before every update and replaced atomically.
+    Updates hold an exclusive lock on a lock file next to it, so several processes can share it.
+    On Windows there is no file lock, and updates are only serialized within a process.
+    """
+
+    def __init__(self, path: Path = None) -> None:
+        if not path:
+            path = platformdirs.user_data_path("video-preview").joinpath("quota.json")
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the thread lock and, where supported, an exclusive lock on the lock file."""
+        with self._lock:
+            if not fcntl:
+                yield
+                return
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path.with_suffix(".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _today(self) -> str:
+        return datetime.now(timezone.utc).date().isoformat()
+
+    def _load(self) -> dict:
+        try:
+            return json.loads(self.path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save(self, ledger: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(ledger))
+        temporary.replace(self.path)
+
+    def used(self, provider: str) -> int:
+        """Get the number of requests made today for a provider."""
+        # The file is replaced atomically, so reading it needs no file lock
+        with self._lock:
+            ledger = self._load()
+        if provider in ledger:
+            if ledger[provider]["date"] == self._today():
+                return ledger[provider]["count"]
+        return 0
+
+    def record(self, provider: str, count: int = 1) -> None:
+        """Add count requests to today's total for a provider."""
+        today = self._today()
+        with self._locked():
+            ledger = self._load()
+            if provider not in ledger or ledger[provider]["date"] != today:
+                ledger[provider] = {"date": today, "count": 0}
+            ledger[provider]["count"] += count
+            self._save(ledger)
+
+
+class ProviderLimiter:
+    """Rate limit and daily quota for a single provider."""
+
+    def __init__(
+        self,
+        provider: str,
+        rate: float,
+        burst: int,
+        daily_limit: int = None,
+        ledger: QuotaLedger = None,
+    ) -> None:
+        self.provider = provider
+        self.daily_limit = daily_limit
+        self.bucket = TokenBucket(rate, burst)
+        self.ledger = ledger
+
+    def remaining(self) -> int | None:
+        """Get the number of requests left today, or None if there is no daily limit."""
+        if not self.daily_limit:
+            return None
+        return max(0, self.daily_limit - self.ledger.used(self.provider))
+
+    def acquire(self) -> None:
+        """Wait for the rate limit. Raises QuotaExceededError if today's quota is used up."""
+        if self.remaining() == 0:
+            raise QuotaExceededError(f"{self.provider} daily quota is used up")
+        self.bucket.acquire()
+
+    def record(self, response=None) -> None:
+        """Count a request against the daily quota. Cached responses are not counted."""
+        if getattr(response, "from_cache", False):
+            return
+        if self.daily_limit:
+            self.ledger.record(self.provider)
+
+
+_ledger = None
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    """Get the limiter shared by every downloader of a provider."""
+    global _ledger
+
+    with _limiters_lock:
+        if provider not in _limiters:
+            if not _ledger:
+                _ledger = QuotaLedger()
+            limits = LIMITS.get(
+                provider, {"rate": 10, "burst": 10, "daily_limit": None}
+            )
+            _limiters[provider] = ProviderLimiter(provider, ledger=_ledger, **limits)
+        return _limiters[provider]
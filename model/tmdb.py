@@ -1,23 +1,39 @@
 import sys
-import json
-import requests
-import requests_cache
 from pathlib import Path
 
-import functools
+import threading
+import time
 
 # Always import relative to *this* file's parent directory
 sys.path.append(Path(__file__).parent.as_posix())
+from cache import get_negative_cache, get_object_cache
+from client import get_expiration, get_json, get_session, is_offline
+from index import get_media_index
+from ratelimit import get_limiter
 from metadata import Series, Network, Season, Episode, Movie
 
 
 class MetadataDownloader:
+    source = "tmdb"
+
+    # Searches without results are not repeated for 6 hours
+    negative_ttl = 3600 * 6
+
+    # TMDB allows at most 20 items in append_to_response for a single request
+    append_limit = 20
+
     def __init__(self, keyfile: str = "TMDB_API_KEY") -> None:
         """Initialize the MetadataDownloader with the TMDB API key."""
         self.token = None
         self.session = None
-        self.genres = {}
-        self.timeout = 60
+        self.limiter = get_limiter(self.source)
+        self.object_cache = get_object_cache()
+        self.negative_cache = get_negative_cache()
+        self.index = get_media_index()
+        # Static reference data (genre lists, etc.) keyed by (namespace, name)
+        self.reference_ttl = 3600 * 24
+        self._reference_cache = {}
+        self._reference_lock = threading.Lock()
         self._load_token(keyfile=keyfile)
 
     def _load_token(self, keyfile):
@@ -26,40 +42,57 @@ class MetadataDownloader:
         with open(keyfile) as fn:
             self.token = fn.read().strip()
 
-    def _new_session(
-        self, cache_name: str = "metadata_cache", expiration: int = 3600 * 24 * 30
-    ):
-        """Create a new requests session with caching."""
-        requests_cache.install_cache(
-            cache_name=cache_name,
-            backend="sqlite",
-            expire_after=expiration,
-        )
-        self.session = requests.Session()
-        self.session.request = functools.partial(
-            self.session.request, timeout=self.timeout
-        )
+    def _get_tmdb(self, endpoint, params={}, expire_after=None):
+        """
+        Make a GET request to the TMDB API.
 
-    def _get_tmdb(self, endpoint, params={}):
-        """Make a GET request to the TMDB API."""
+        expire_after overrides the cache lifetime of the response.
+        """
         url = f"https://api.themoviedb.org/3/{endpoint}"
 
         if not self.session:
-            self._new_session()
+            self.session = get_session()
 
         headers = {
             "accept": "application/json",
             "Authorization": "Bearer {}".format(self.token),
         }
-        response = self.session.get(url, headers=headers, params=params)
-        return json.loads(response.text)
+        return get_json(
+            self.session,
+            url,
+            self.limiter,
+            params=params,
+            headers=headers,
+            expire_after=expire_after,
+        )
+
+    def remaining(self) -> int | None:
+        """
+        Get the number of requests left today, or None if there is no daily limit.
+
+        There is no limit in offline mode because no requests are sent.
+        """
+        if is_offline():
+            return None
+        return self.limiter.remaining()
+
+    def is_known_empty(self, name: str, year: int = None, kind: str = "series") -> bool:
+        """Check if a search is known to have no results, without sending any requests."""
+        return self.negative_cache.is_empty(self.source, kind, name, year)
+
+    def _set_empty(self, name: str, year: int = None, kind: str = "series") -> None:
+        """Remember that a search had no results. Offline cache misses are not remembered."""
+        if not is_offline():
+            self.negative_cache.add(
+                self.source, kind, name, year, ttl=self.negative_ttl
+            )
 
     def _get_tmdb_image(self, endpoint: str, image_directory: Path = Path(".")) -> None:
         """Download an image from the TMDB API."""
         url = f"https://image.tmdb.org/t/p/original{endpoint}"
 
         if not self.session:
-            self._new_session()
+            self.session = get_session()
 
         headers = {
             "accept": "application/json",
@@ -95,14 +128,18 @@ class MetadataDownloader:
                 series.ids[key] = external_ids[key]
 
     def _process_tmdb_movie_results(self, results):
-        """Process the movie results from the TMDB API search."""
+        """
+        Process the movie results from the TMDB API search.
+
+        Results should already be sliced to the wanted limit.
+        External IDs are added later by hydrate.
+        """
+        genres = self._get_movie_genres()
         movie_results = []
         for result in results:
             movie = Movie()
             if "id" in result:
                 movie.ids["tmdb"] = int(result["id"])
-                external_ids = self._get_movie_external_ids(movie.ids["tmdb"])
-                self._process_external_ids(movie, external_ids)
             if "title" in result:
                 movie.name = result["title"]
             if "release_date" in result:
@@ -114,10 +151,9 @@ class MetadataDownloader:
             if "original_title" in result:
                 movie.original_name = result["original_title"]
             if "genre_ids" in result:
-                self._get_movie_genres()
                 for _id in result["genre_ids"]:
-                    if _id in self.genres:
-                        genre = self.genres[_id]
+                    if _id in genres:
+                        genre = genres[_id]
                         if genre not in movie.genres:
                             movie.genres += [genre]
             if "poster_path" in result:
@@ -127,14 +163,18 @@ class MetadataDownloader:
         return movie_results
 
     def _process_tmdb_series_results(self, results):
-        """Process the results from the TMDB API search."""
+        """
+        Process the results from the TMDB API search.
+
+        Results should already be sliced to the wanted limit.
+        External IDs are added later by hydrate.
+        """
+        genres = self._get_series_genres()
         series_results = []
         for result in results:
             series = Series()
             if "id" in result:
                 series.ids["tmdb"] = int(result["id"])
-                external_ids = self._get_series_external_ids(series.ids["tmdb"])
-                self._process_external_ids(series, external_ids)
             if "name" in result:
                 series.name = result["name"]
             if "first_air_date":
@@ -146,10 +186,9 @@ class MetadataDownloader:
             if "original_name" in result:
                 series.original_name = result["original_name"]
             if "genre_ids" in result:
-                self._get_series_genres()
                 for _id in result["genre_ids"]:
-                    if _id in self.genres:
-                        genre = self.genres[_id]
+                    if _id in genres:
+                        genre = genres[_id]
                         if genre not in series.genres:
                             series.genres += [genre]
             if "poster_path" in result:
@@ -158,16 +197,18 @@ class MetadataDownloader:
             series_results += [series]
         return series_results
 
-    def search_movies(
+    def search_movies_stubs(
         self,
         name: str,
         year: int = None,
         adult: bool = False,
         language="en-US",
         limit=5,
-    ):
-        """Search for movie on TMDB."""
-        all_movies = []
+    ) -> list[Movie]:
+        """Search for movie stubs on TMDB without fetching any details."""
+        if self.is_known_empty(name, year, "movie"):
+            return []
+
         endpoint = "search/movie"
         params = {"query": name, "language": language}
         if year:
@@ -176,27 +217,28 @@ class MetadataDownloader:
             params["include_adult"] = "true"
         content = self._get_tmdb(endpoint=endpoint, params=params)
 
-        if "results" in content:
-            results = self._process_tmdb_movie_results(content["results"])
-            if len(results) > limit:
-                results = results[0:limit]
-            for movie in results:
-                _id = movie.ids["tmdb"]
-                content = self._get_movie_details(_id)
-                series = self._process_tmdb_movie_details(movie, content)
-                all_movies += [series]
-        return all_movies
+        if "results" not in content:
+            return []
+        if not content["results"]:
+            self._set_empty(name, year, "movie")
 
-    def search_series(
+        # Slice before processing so only the kept results are enriched
+        results = self._process_tmdb_movie_results(content["results"][0:limit])
+        self.index.add_all(results, replace=False)
+        return results
+
+    def search_series_stubs(
         self,
         name: str,
         year: int = None,
         adult: bool = False,
         language="en-US",
         limit=5,
-    ):
-        """Search for series on TMDB."""
-        all_series = []
+    ) -> list[Series]:
+        """Search for series stubs on TMDB without fetching any details or seasons."""
+        if self.is_known_empty(name, year, "series"):
+            return []
+
         endpoint = "search/tv"
         params = {"query": name, "language": language}
         if year:
@@ -205,19 +247,104 @@ class MetadataDownloader:
             params["include_adult"] = "true"
         content = self._get_tmdb(endpoint=endpoint, params=params)
 
-        if "results" in content:
-            results = self._process_tmdb_series_results(content["results"])
-            if len(results) > limit:
-                results = results[0:limit]
-            for series in results:
-                _id = series.ids["tmdb"]
-                content = self._get_series_details(_id)
-                series = self._process_tmdb_series_details(series, content)
-                for season in series.seasons.keys():
-                    content = self._get_series_season(_id, season)
-                    series = self._process_tmdb_series_season(series, content)
-                all_series += [series]
-        return all_series
+        if "results" not in content:
+            return []
+        if not content["results"]:
+            self._set_empty(name, year, "series")
+
+        # Slice before processing so only the kept results are enriched
+        results = self._process_tmdb_series_results(content["results"][0:limit])
+        self.index.add_all(results, replace=False)
+        return results
+
+    def hydrate(self, media: Series | Movie, on_progress=None) -> Series | Movie:
+        """
+        Fetch the full details of a series or movie stub from TMDB.
+
+        If on_progress is given, it is called with the series as each batch of seasons is merged.
+        Finished results are kept in the object cache.
+        """
+        kind = "movie" if isinstance(media, Movie) else "series"
+        key = self.object_cache.make_key(self.source, kind, media.ids["tmdb"])
+        cached = self.object_cache.get(key)
+        if cached:
+            return cached
+
+        if isinstance(media, Movie):
+            media = self._hydrate_movie(media)
+        else:
+            media = self._hydrate_series(media, on_progress=on_progress)
+
+        if isinstance(media, Series):
+            media.build_index()
+
+        if media.is_valid():
+            ttl = None
+            if isinstance(media, Series):
+                # Series still airing get new episodes, so they are kept for less time
+                ttl = get_expiration(media.status)
+            self.object_cache.set(key, media, ttl=ttl)
+            self.index.add(media)
+        return media
+
+    def _hydrate_movie(self, movie: Movie) -> Movie:
+        """Fetch the details and external IDs of a movie stub from TMDB."""
+        content = self._get_movie_details(movie.ids["tmdb"], append=["external_ids"])
+        if "external_ids" in content:
+            self._process_external_ids(movie, content["external_ids"])
+        return self._process_tmdb_movie_details(movie, content)
+
+    def _hydrate_series(self, series: Series, on_progress=None) -> Series:
+        """
+        Fetch the details, external IDs and every season of a series stub from TMDB.
+
+        Seasons are requested in batches using append_to_response,
+        so a series costs one request plus one request per batch of seasons.
+        Seasons of ended series are cached for longer than those still airing.
+        """
+        _id = series.ids["tmdb"]
+        content = self._get_series_details(_id, append=["external_ids"])
+        if "external_ids" in content:
+            self._process_external_ids(series, content["external_ids"])
+        series = self._process_tmdb_series_details(series, content)
+        series.status = content.get("status") or ""
+        expire_after = get_expiration(series.status)
+
+        season_numbers = list(series.seasons.keys())
+        for index in range(0, len(season_numbers), self.append_limit):
+            batch = season_numbers[index : index + self.append_limit]
+            content = self._get_series_seasons(_id, batch, expire_after=expire_after)
+            for season_number in batch:
+                key = f"season/{season_number}"
+                if key in content:
+                    series = self._process_tmdb_series_season(series, content[key])
+            if on_progress:
+                on_progress(series)
+        return series
+
+    def search_movies(
+        self,
+        name: str,
+        year: int = None,
+        adult: bool = False,
+        language="en-US",
+        limit=5,
+    ):
+        """Search for movie on TMDB."""
+        results = self.search_movies_stubs(name, year, adult, language, limit)
+        return [self.hydrate(movie) for movie in results]
+
+    def search_series(
+        self,
+        name: str,
+        year: int = None,
+        adult: bool = False,
+        language="en-US",
+        limit=5,
+    ):
+        """Search for series on TMDB."""
+        results = self.search_series_stubs(name, year, adult, language, limit)
+        return [self.hydrate(series) for series in results]
 
     def _process_tmdb_series_details(self, series: Series, details):
         """Process the details of a series from TMDB."""
@@ -235,7 +362,7 @@ class MetadataDownloader:
                     network.name = series_network["name"]
                 if "origin_country" in series_network:
                     network.origin_country = series_network["origin_country"]
-                series.networks += [network]
+                series.networks += [Network.intern(network)]
         if "seasons" in details:
             for series_season in details["seasons"]:
                 season = Season()
@@ -263,17 +390,35 @@ class MetadataDownloader:
 
         return movie
 
-    def _get_series_details(self, series_id: int):
-        """Get the details of a series from TMDB."""
+    def _get_series_details(
+        self, series_id: int, append: list[str] = None, expire_after=None
+    ):
+        """
+        Get the details of a series from TMDB.
+
+        Any endpoints in append are returned in the same response under their own key.
+        """
 
         endpoint = f"tv/{series_id}"
-        return self._get_tmdb(endpoint)
+        append = append or []
+        params = {}
+        if append:
+            params["append_to_response"] = ",".join(append)
+        return self._get_tmdb(endpoint, params=params, expire_after=expire_after)
+
+    def _get_movie_details(self, movie_id: int, append: list[str] = None):
+        """
+        Get the details of a movie from TMDB.
 
-    def _get_movie_details(self, movie_id: int):
-        """Get the details of a movie from TMDB."""
+        Any endpoints in append are returned in the same response under their own key.
+        """
 
         endpoint = f"movie/{movie_id}"
-        return self._get_tmdb(endpoint)
+        append = append or []
+        params = {}
+        if append:
+            params["append_to_response"] = ",".join(append)
+        return self._get_tmdb(endpoint, params=params)
 
     def _process_tmdb_series_season(self, series, season):
         """Process the details of a season from TMDB."""
@@ -312,50 +457,71 @@ class MetadataDownloader:
                         episode.series_id = season_episode["series_id"]
                     if "still_path" in season_episode:
                         episode.still_path = season_episode["still_path"]
+                    if "air_date" in season_episode:
+                        if season_episode["air_date"]:
+                            episode.air_date = season_episode["air_date"]
                     series.seasons[number].episodes[episode.number] = episode
         return series
 
-    def _get_series_season(self, series_id: int, season_number: int):
-        """Get the details of a season from TMDB."""
+    def _get_series_seasons(
+        self, series_id: int, season_numbers: list[int], expire_after=None
+    ):
+        """
+        Get the details of several seasons from TMDB in a single request.
 
-        endpoint = f"tv/{series_id}/season/{season_number}"
-        return self._get_tmdb(endpoint)
+        Each season is returned under a "season/<number>" key.
+        """
 
-    def _get_series_genres(self):
-        """Get all possible genres of a series from TMDB."""
+        append = [f"season/{number}" for number in season_numbers]
+        return self._get_series_details(
+            series_id, append=append[: self.append_limit], expire_after=expire_after
+        )
 
-        genres = {}
-        endpoint = "genre/tv/list"
-        content = self._get_tmdb(endpoint)
-        if "genres" in content:
-            for genre in content["genres"]:
-                _id = genre["id"]
-                if _id not in genres:
-                    genres[_id] = genre["name"]
-        self.genres = genres
+    def _get_reference(self, namespace: str, name: str, loader):
+        """
+        Get static reference data from the per-instance cache.
 
-    def _get_movie_genres(self):
-        """Get all possible genres of a movie from TMDB."""
+        Reference data is loaded once and kept until reference_ttl seconds pass.
+        Namespaces keep TV and movie tables apart, e.g. ("tv", "genres").
+        """
+        key = (namespace, name)
+        with self._reference_lock:
+            if key in self._reference_cache:
+                expires, data = self._reference_cache[key]
+                if time.monotonic() < expires:
+                    return data
+
+        data = loader()
+
+        # Empty data is most likely a failed request, so do not keep it
+        if data:
+            with self._reference_lock:
+                expires = time.monotonic() + self.reference_ttl
+                self._reference_cache[key] = (expires, data)
+        return data
+
+    def _load_genres(self, namespace: str) -> dict[int, str]:
+        """Load all possible genres of a namespace (tv or movie) from TMDB."""
 
         genres = {}
-        endpoint = "genre/movie/list"
+        endpoint = f"genre/{namespace}/list"
         content = self._get_tmdb(endpoint)
         if "genres" in content:
             for genre in content["genres"]:
                 _id = genre["id"]
                 if _id not in genres:
                     genres[_id] = genre["name"]
-        self.genres = genres
+        return genres
 
-    def _get_series_external_ids(self, series_id: int):
-        """Get the external IDs of a series from TMDB."""
-        endpoint = f"tv/{series_id}/external_ids"
-        return self._get_tmdb(endpoint)
+    def _get_series_genres(self) -> dict[int, str]:
+        """Get all possible genres of a series from TMDB."""
+        return self._get_reference("tv", "genres", lambda: self._load_genres("tv"))
 
-    def _get_movie_external_ids(self, movie_id: int):
-        """Get the external IDs of a movie from TMDB."""
-        endpoint = f"tv/{movie_id}/external_ids"
-        return self._get_tmdb(endpoint)
+    def _get_movie_genres(self) -> dict[int, str]:
+        """Get all possible genres of a movie from TMDB."""
+        return self._get_reference(
+            "movie", "genres", lambda: self._load_genres("movie")
+        )
 
 
 if __name__ == "__main__":
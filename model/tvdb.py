@@ -1,39 +1,42 @@
 import sys
 import json
-import requests
-import requests_cache
 from pathlib import Path
 
-import functools
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Always import relative to *this* file's parent directory
 sys.path.append(Path(__file__).parent.as_posix())
+from cache import get_negative_cache, get_object_cache
+from client import get_expiration, get_json, get_session, is_offline
+from index import get_media_index
+from ratelimit import get_limiter
 from metadata import Series, Network, Season, Episode, Movie
 
 
 class MetadataDownloader:
     """This class is a wrapper around the TVDB API to download metadata for series and episodes."""
 
+    source = "tvdb"
+
+    # Searches without results are not repeated for 6 hours
+    negative_ttl = 3600 * 6
+
     def __init__(self, keyfile="TVDB_API_KEY") -> None:
         self.token = None
         self.session = None
         self.genres = {}
-        self.timeout = 60
+        self.limiter = get_limiter(self.source)
+        self.object_cache = get_object_cache()
+        self.negative_cache = get_negative_cache()
+        self.index = get_media_index()
+        self.max_workers = 8
+        # Season records keyed by season id
+        self._seasons = {}
+        self._seasons_lock = threading.Lock()
         self._load_token(keyfile=keyfile)
 
-    def _new_session(
-        self, cache_name: str = "metadata_cache", expiration: int = 3600 * 24 * 30
-    ):
-        requests_cache.install_cache(
-            cache_name=cache_name,
-            backend="sqlite",
-            expire_after=expiration,
-        )
-        self.session = requests.Session()
-        self.session.request = functools.partial(
-            self.session.request, timeout=self.timeout
-        )
-
     def _load_token(self, keyfile) -> None:
         with open(keyfile) as fn:
             apikey = fn.read().strip()
@@ -41,8 +44,12 @@ class MetadataDownloader:
         if not apikey:
             return
 
+        # Cached responses do not need a token, and logging in would need the network
+        if is_offline():
+            return
+
         if not self.session:
-            self._new_session()
+            self.session = get_session()
 
         endpoint = "login"
         login_url = f"https://api4.thetvdb.com/v4/{endpoint}"
@@ -55,35 +62,76 @@ class MetadataDownloader:
             content = json.loads(raw_content)
             self.token = content["data"]["token"]
 
-    def _get_tvdb(self, endpoint, params={}):
+    def _get_tvdb(self, endpoint, params={}, expire_after=None):
+        raw_json = self._get_tvdb_raw(
+            endpoint, params=params, expire_after=expire_after
+        )
+        if "data" in raw_json:
+            data = raw_json["data"]
+            if data:
+                return data
+        return {}
+
+    def _get_tvdb_raw(self, endpoint, params={}, expire_after=None):
+        """
+        Get the whole response, including "links" used for paging.
+
+        expire_after overrides the cache lifetime of the response.
+        """
         url = f"https://api4.thetvdb.com/v4/{endpoint}"
 
         if not self.session:
-            self._new_session()
+            self.session = get_session()
 
-        if not self.token:
+        if not self.token and not is_offline():
             self._load_token()
 
         headers = {
             "accept": "application/json",
             "Authorization": "Bearer {}".format(self.token),
         }
-        response = self.session.get(url, headers=headers, params=params)
-        raw_json = json.loads(response.text)
-        if "data" in raw_json:
-            data = raw_json["data"]
-            if data:
-                return data
-        return {}
+        return get_json(
+            self.session,
+            url,
+            self.limiter,
+            params=params,
+            headers=headers,
+            expire_after=expire_after,
+        )
 
-    def search(
+    def remaining(self) -> int | None:
+        """
+        Get the number of requests left today, or None if there is no daily limit.
+
+        There is no limit in offline mode because no requests are sent.
+        """
+        if is_offline():
+            return None
+        return self.limiter.remaining()
+
+    def is_known_empty(self, name: str, year: int = None, kind: str = "series") -> bool:
+        """Check if a search is known to have no results, without sending any requests."""
+        return self.negative_cache.is_empty(self.source, kind, name, year)
+
+    def _set_empty(self, name: str, year: int = None, kind: str = "series") -> None:
+        """Remember that a search had no results. Offline cache misses are not remembered."""
+        if not is_offline():
+            self.negative_cache.add(
+                self.source, kind, name, year, ttl=self.negative_ttl
+            )
+
+    def search_stubs(
         self,
         name: str,
         year: int = None,
         media_type: str = "series",
         language: str = "eng",
         limit: int = 5,
-    ) -> list[Series]:
+    ) -> list[Series | Movie]:
+        """Search TVDB using only the search results, without any extra requests."""
+        if self.is_known_empty(name, year, media_type):
+            return []
+
         params = {
             "query": name,
             "language": language,
@@ -92,15 +140,58 @@ class MetadataDownloader:
         }
         if year:
             params["year"] = year
-        all_series = self._get_tvdb("search", params=params)
-        if not all_series:
+        raw_json = self._get_tvdb_raw("search", params=params)
+        all_results = raw_json.get("data")
+        if not all_results:
+            # Only remember searches TVDB answered, not expired tokens or outages
+            if raw_json.get("status") == "success" and isinstance(all_results, list):
+                self._set_empty(name, year, media_type)
             return []
 
         match media_type:
             case "series":
-                return self._process_series(all_series, language=language)
+                results = [
+                    self._process_stub(Series(), s, language) for s in all_results
+                ]
+                self.index.add_all(results, replace=False)
+                return results
             case "movie":
-                return self._process_movies(all_series, language=language)
+                results = [
+                    self._process_stub(Movie(), s, language) for s in all_results
+                ]
+                self.index.add_all(results, replace=False)
+                return results
+        return []
+
+    def search(
+        self,
+        name: str,
+        year: int = None,
+        media_type: str = "series",
+        language: str = "eng",
+        limit: int = 5,
+    ) -> list[Series]:
+        stubs = self.search_stubs(name, year, media_type, language, limit)
+        all_media = [self.hydrate(stub, language=language) for stub in stubs]
+        return [media for media in all_media if media.is_valid()]
+
+    def search_series_stubs(
+        self,
+        name: str,
+        year: int = None,
+        language: str = "eng",
+        limit: int = 5,
+    ) -> list[Series]:
+        return self.search_stubs(name, year, "series", language, limit)
+
+    def search_movies_stubs(
+        self,
+        name: str,
+        year: int = None,
+        language: str = "eng",
+        limit: int = 5,
+    ) -> list[Movie]:
+        return self.search_stubs(name, year, "movie", language, limit)
 
     def search_series(
         self,
@@ -120,6 +211,49 @@ class MetadataDownloader:
     ) -> list[Series]:
         return self.search(name, year, "movie", language, limit)
 
+    def hydrate(
+        self,
+        media: Series | Movie,
+        language: str = "eng",
+        season_type: str = "official",
+        on_progress=None,
+    ) -> Series | Movie:
+        """
+        Fetch the full details of a series or movie stub from TVDB.
+
+        If on_progress is given, it is called with the series as each page of episodes is merged.
+        Finished results are kept in the object cache.
+        """
+        kind = "movie" if isinstance(media, Movie) else "series"
+        key = self.object_cache.make_key(
+            self.source, kind, media.ids["tvdb"], language, season_type
+        )
+        cached = self.object_cache.get(key)
+        if cached:
+            return cached
+
+        if isinstance(media, Movie):
+            media = self._hydrate_movie(media, language=language)
+        else:
+            media = self._hydrate_series(
+                media,
+                language=language,
+                season_type=season_type,
+                on_progress=on_progress,
+            )
+
+        if isinstance(media, Series):
+            media.build_index()
+
+        if media.is_valid():
+            ttl = None
+            if isinstance(media, Series):
+                # Series still airing get new episodes, so they are kept for less time
+                ttl = get_expiration(media.status)
+            self.object_cache.set(key, media, ttl=ttl)
+            self.index.add(media)
+        return media
+
     def _get_series_extended(self, series_id: int) -> dict:
         endpoint = f"series/{series_id}/extended"
         return self._get_tvdb(endpoint)
@@ -137,202 +271,305 @@ class MetadataDownloader:
         return self._get_tvdb(endpoint)
 
     def _get_season(self, season_id: int) -> dict:
-        endpoint = f"seasons/{season_id}"
-        return self._get_tvdb(endpoint)
+        with self._seasons_lock:
+            if season_id in self._seasons:
+                return self._seasons[season_id]
 
-    def _get_series_episodes(
-        self, series_id: int, season_type: str = "official", lang: str = "eng"
-    ) -> dict:
-        endpoint = f"series/{series_id}/episodes/{season_type}/{lang}"
-        return self._get_tvdb(endpoint)
-
-    def _process_movies(
-        self, all_movies: list[dict], language: str = "eng"
-    ) -> list[Movie]:
-        all_features = []
-        for s in all_movies:
-            movie = Movie()
-            movie.ids["tvdb"] = s["tvdb_id"]
-            movie_extended = self._get_movie_extended(movie.ids["tvdb"])
-            movie_translation = self._get_movie_translations(
-                movie.ids["tvdb"], language=language
-            )
-
-            if "name" in movie_translation:
-                movie.name = movie_translation["name"]
-            if "name" in s:
-                movie.original_name = s["name"]
+        endpoint = f"seasons/{season_id}"
+        season = self._get_tvdb(endpoint)
 
-            if "artworks" in movie_extended:
-                for artwork in movie_extended["artworks"]:
-                    match artwork["type"]:
-                        case 1:  # Banner
-                            if not movie.backdrop_path:
-                                movie.backdrop_path = artwork["image"]
-                        case 2:  # Poster
-                            if not movie.poster_path:
-                                movie.poster_path = artwork["image"]
+        if season:
+            with self._seasons_lock:
+                self._seasons[season_id] = season
+        return season
 
-            if "genres" in movie_extended:
-                for genre in movie_extended["genres"]:
-                    movie.genres += [genre]
+    def _resolve_seasons(self, series_seasons: list[dict]) -> list[dict]:
+        """
+        Get a season record including its type for each season of a series.
 
-            if "overview" in movie_translation:
-                movie.overview = movie_translation["overview"]
+        Seasons from series/{id}/extended usually include their type already and are used as is.
+        Any others are requested concurrently, so this takes as long as the slowest request.
+        """
+        records = [{} for _ in series_seasons]
+        missing = []
+        for index, series_season in enumerate(series_seasons):
+            season_type = series_season.get("type")
+            if isinstance(season_type, dict) and "type" in season_type:
+                records[index] = series_season
+            elif "id" in series_season:
+                missing += [index]
+
+        if missing:
+            workers = min(self.max_workers, len(missing))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                season_ids = [series_seasons[index]["id"] for index in missing]
+                for index, record in zip(
+                    missing, executor.map(self._get_season, season_ids)
+                ):
+                    records[index] = record
+
+        return records
 
-            if "first_air_time" in s:
-                movie.air_date = s["first_air_time"]
+    def _get_series_episodes(
+        self,
+        series_id: int,
+        season_type: str = "official",
+        lang: str = "eng",
+        page: int = 0,
+        expire_after=None,
+    ) -> tuple[dict, dict]:
+        """Get one page of episodes along with the paging links."""
+        endpoint = f"series/{series_id}/episodes/{season_type}/{lang}"
+        raw_json = self._get_tvdb_raw(
+            endpoint, params={"page": page}, expire_after=expire_after
+        )
+        data = raw_json.get("data") or {}
+        links = raw_json.get("links") or {}
+        return data, links
 
-            if "year" in s:
-                movie.year = int(s["year"])
+    def _iter_series_episodes(
+        self,
+        series_id: int,
+        season_type: str = "official",
+        lang: str = "eng",
+        expire_after=None,
+    ):
+        """
+        Yield every page of episodes for a series.
 
-            if "network" in s:
-                network = Network()
-                network.name = s["network"]
-                movie.networks += [network]
+        The first page gives the page count, then the remaining pages are requested concurrently.
+        Pages are yielded in the order they arrive.
+        """
+        data, links = self._get_series_episodes(
+            series_id, season_type, lang, expire_after=expire_after
+        )
+        yield data
+
+        total_items = links.get("total_items")
+        page_size = links.get("page_size")
+
+        # Without a page count, follow the next links one at a time
+        if not total_items or not page_size:
+            page = 0
+            while links.get("next"):
+                page += 1
+                data, links = self._get_series_episodes(
+                    series_id, season_type, lang, page, expire_after
+                )
+                if not data:
+                    break
+                yield data
+            return
 
-            movie.source = "tvdb"
-            if movie.is_valid():
-                all_features += [movie]
+        pages = range(1, math.ceil(total_items / page_size))
+        if not pages:
+            return
 
-        return all_features
+        workers = min(self.max_workers, len(pages))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    self._get_series_episodes,
+                    series_id,
+                    season_type,
+                    lang,
+                    page,
+                    expire_after,
+                )
+                for page in pages
+            ]
+            for future in as_completed(futures):
+                data, _ = future.result()
+                yield data
+
+    def _process_stub(
+        self, media: Series | Movie, s: dict, language: str = "eng"
+    ) -> Series | Movie:
+        media.ids["tvdb"] = s["tvdb_id"]
+        media.source = "tvdb"
+
+        if "name" in s:
+            media.name = s["name"]
+            media.original_name = s["name"]
+        if "translations" in s:
+            if s["translations"] and language in s["translations"]:
+                media.name = s["translations"][language]
+        if "overviews" in s:
+            if s["overviews"] and language in s["overviews"]:
+                media.overview = s["overviews"][language]
+        elif "overview" in s:
+            media.overview = s["overview"]
+
+        if "image_url" in s:
+            media.poster_path = s["image_url"]
+
+        if "first_air_time" in s:
+            media.air_date = s["first_air_time"]
+
+        if "year" in s:
+            media.year = int(s["year"])
+
+        if "network" in s:
+            network = Network()
+            network.name = s["network"]
+            media.networks += [Network.intern(network)]
+
+        return media
+
+    def _process_extended(
+        self, media: Series | Movie, extended: dict, translation: dict
+    ) -> Series | Movie:
+        if "name" in translation:
+            media.name = translation["name"]
+
+        if "artworks" in extended:
+            for artwork in extended["artworks"]:
+                match artwork["type"]:
+                    case 1:  # Banner
+                        if not media.backdrop_path:
+                            media.backdrop_path = artwork["image"]
+                    case 2:  # Poster
+                        if not media.poster_path:
+                            media.poster_path = artwork["image"]
+
+        if "genres" in extended:
+            for genre in extended["genres"]:
+                media.genres += [genre]
+
+        if "overview" in translation:
+            media.overview = translation["overview"]
+
+        return media
+
+    def _hydrate_movie(self, movie: Movie, language: str = "eng") -> Movie:
+        movie_extended = self._get_movie_extended(movie.ids["tvdb"])
+        movie_translation = self._get_movie_translations(
+            movie.ids["tvdb"], language=language
+        )
+        return self._process_extended(movie, movie_extended, movie_translation)
 
-    def _process_series(
+    def _hydrate_series(
         self,
-        all_series: list[dict],
+        series: Series,
         language: str = "eng",
         season_type: str = "official",
-    ) -> list[Series]:
-        all_shows = []
-        for s in all_series:
-            series = Series()
-            series.ids["tvdb"] = s["tvdb_id"]
-            series_extended = self._get_series_extended(series.ids["tvdb"])
-            series_translation = self._get_series_translations(
-                series.ids["tvdb"], language=language
-            )
-
-            if "name" in series_translation:
-                series.name = series_translation["name"]
-            if "name" in s:
-                series.original_name = s["name"]
-
-            if "artworks" in series_extended:
-                for artwork in series_extended["artworks"]:
-                    match artwork["type"]:
-                        case 1:  # Series Banner
-                            if not series.backdrop_path:
-                                series.backdrop_path = artwork["image"]
-                        case 2:  # Series Poster
-                            if not series.poster_path:
-                                series.poster_path = artwork["image"]
-
-            if "genres" in series_extended:
-                for genre in series_extended["genres"]:
-                    series.genres += [genre]
-
-            if "overview" in series_translation:
-                series.overview = series_translation["overview"]
-
-            if "first_air_time" in s:
-                series.air_date = s["first_air_time"]
-
-            if "year" in s:
-                series.year = int(s["year"])
-
-            if "network" in s:
-                network = Network()
-                network.name = s["network"]
-                series.networks += [network]
-
-            if "seasons" in series_extended:
-                for series_season in series_extended["seasons"]:
-                    if "type" in series_season:
-                        if "type" == "offical":
-                            break
+        on_progress=None,
+    ) -> Series:
+        series_extended = self._get_series_extended(series.ids["tvdb"])
+        series_translation = self._get_series_translations(
+            series.ids["tvdb"], language=language
+        )
+        series = self._process_extended(series, series_extended, series_translation)
 
-                    season = Season()
+        if "seasons" in series_extended:
+            series_seasons = series_extended["seasons"]
+            tvdb_seasons = self._resolve_seasons(series_seasons)
+            for series_season, tvdb_season in zip(series_seasons, tvdb_seasons):
+                if not tvdb_season:
+                    continue
 
-                    if "id" in series_season:
-                        season.ids["tvdb"] = series_season["id"]
+                if tvdb_season["type"]["type"] != season_type:
+                    continue
 
-                    tvdb_season = self._get_season(season.ids["tvdb"])
-                    if tvdb_season["type"]["type"] != season_type:
-                        continue
+                season = Season()
 
-                    if "number" in tvdb_season:
-                        season.number = series_season["number"]
-                    if "image" in tvdb_season:
-                        season.poster_path = series_season["image"]
+                if "id" in series_season:
+                    season.ids["tvdb"] = series_season["id"]
 
-                    season.series_name = series.name
+                if "number" in tvdb_season:
+                    season.number = series_season["number"]
+                if "image" in tvdb_season:
+                    season.poster_path = series_season["image"]
 
-                    if season.number not in series.seasons:
-                        series.seasons[season.number] = season
+                season.series_name = series.name
 
-            # Season will not be valid until after episodes are processed
+                if season.number not in series.seasons:
+                    series.seasons[season.number] = season
 
-            series.source = "tvdb"
-            series = self._process_episodes(series, season_type=season_type)
+        # Season will not be valid until after episodes are processed
 
-            # Empty seasons are possible, so remove them if they exist
-            keys_to_remove = []
-            for key in series.seasons:
-                if not series.seasons[key].episodes:
-                    keys_to_remove += [key]
-            for key in keys_to_remove:
-                series.seasons.pop(key)
+        # Episodes of ended series are cached for longer than those still airing
+        status = series_extended.get("status") or {}
+        series.status = status.get("name") or ""
+        series = self._process_episodes(
+            series,
+            season_type=season_type,
+            on_progress=on_progress,
+            expire_after=get_expiration(series.status),
+        )
 
-            if series.is_valid():
-                all_shows += [series]
+        # Empty seasons are possible, so remove them if they exist
+        keys_to_remove = []
+        for key in series.seasons:
+            if not series.seasons[key].episodes:
+                keys_to_remove += [key]
+        for key in keys_to_remove:
+            series.seasons.pop(key)
 
-        return all_shows
+        return series
 
     def _process_episodes(
-        self, series: Series, season_type: str = "official", lang: str = "eng"
+        self,
+        series: Series,
+        season_type: str = "official",
+        lang: str = "eng",
+        on_progress=None,
+        expire_after=None,
     ) -> Series:
         """
         season_type: official, dvd, absolute, alternate, regional, altdvd, alttwo
 
+        Episodes are merged into the series as each page arrives.
+        If on_progress is given, it is called with the series after every page.
+        expire_after overrides the cache lifetime of the episode pages.
         """
 
-        series_episodes = self._get_series_episodes(
-            series.ids["tvdb"], season_type=season_type, lang=lang
-        )
+        for series_episodes in self._iter_series_episodes(
+            series.ids["tvdb"],
+            season_type=season_type,
+            lang=lang,
+            expire_after=expire_after,
+        ):
+            if "episodes" in series_episodes:
+                for series_episode in series_episodes["episodes"]:
+                    episode = Episode()
+                    episode.ids["tvdb"] = series_episode["id"]
+                    episode.series_name = series.name
+
+                    if "name" in series_episode:
+                        episode.name = series_episode["name"]
+                    if "number" in series_episode:
+                        episode.number = int(series_episode["number"])
+                    if "seasonNumber" in series_episode:
+                        episode.season_number = int(series_episode["seasonNumber"])
+                    if "overview" in series_episode:
+                        episode.overview = series_episode["overview"]
+                    if "runtime" in series_episode:
+                        if series_episode["runtime"]:
+                            episode.runtime = int(series_episode["runtime"]) * 60
+                    if "seriesId" in series_episode:
+                        episode.series_id = series_episode["seriesId"]
+                    if "image" in series_episode:
+                        episode.still_path = series_episode["image"]
+                    if "finaleType" in series_episode:
+                        episode.type = series_episode["finaleType"]
+                    if "aired" in series_episode:
+                        if series_episode["aired"]:
+                            episode.air_date = series_episode["aired"]
+
+                    if episode.season_number in series.seasons:
+                        if (
+                            episode.number
+                            not in series.seasons[episode.season_number].episodes
+                        ):
+                            if episode.is_valid():
+                                series.seasons[episode.season_number].episodes[
+                                    episode.number
+                                ] = episode
+
+            if on_progress:
+                on_progress(series)
 
-        if "episodes" in series_episodes:
-            for series_episode in series_episodes["episodes"]:
-                episode = Episode()
-                episode.ids["tvdb"] = series_episode["id"]
-                episode.series_name = series.name
-
-                if "name" in series_episode:
-                    episode.name = series_episode["name"]
-                if "number" in series_episode:
-                    episode.number = int(series_episode["number"])
-                if "seasonNumber" in series_episode:
-                    episode.season_number = int(series_episode["seasonNumber"])
-                if "overview" in series_episode:
-                    episode.overview = series_episode["overview"]
-                if "runtime" in series_episode:
-                    if series_episode["runtime"]:
-                        episode.runtime = int(series_episode["runtime"]) * 60
-                if "seriesId" in series_episode:
-                    episode.series_id = series_episode["seriesId"]
-                if "image" in series_episode:
-                    episode.still_path = series_episode["image"]
-                if "finaleType" in series_episode:
-                    episode.type = series_episode["finaleType"]
-
-                if episode.season_number in series.seasons:
-                    if (
-                        episode.number
-                        not in series.seasons[episode.season_number].episodes
-                    ):
-                        if episode.is_valid():
-                            series.seasons[episode.season_number].episodes[
-                                episode.number
-                            ] = episode
         return series
 
 
@@ -1,65 +1,135 @@
 import sys
-import json
 import lxml.html
-import requests
-import requests_cache
-import functools
 
 from pathlib import Path
 
 # Always import relative to *this* file's parent directory
 sys.path.append(Path(__file__).parent.as_posix())
+from cache import get_negative_cache, get_object_cache
+from client import get_expiration, get_json, get_session, is_offline
+from index import get_media_index
+from ratelimit import get_limiter
 from metadata import Series, Network, Season, Episode, Movie
 
 
 class MetadataDownloader:
     """This class is a wrapper around the TV Maze API to download metadata for series and episodes."""
 
+    source = "tvmaze"
+
+    # Searches without results are not repeated for 6 hours
+    negative_ttl = 3600 * 6
+
     def __init__(self) -> None:
         self.session = None
-        self.timeout = 60
-
-    def _new_session(
-        self, cache_name: str = "metadata_cache", expiration: int = 3600 * 24 * 30
-    ):
-        requests_cache.install_cache(
-            cache_name=cache_name,
-            backend="sqlite",
-            expire_after=expiration,
-        )
-        self.session = requests.Session()
-        self.session.request = functools.partial(
-            self.session.request, timeout=self.timeout
-        )
+        self.limiter = get_limiter(self.source)
+        self.object_cache = get_object_cache()
+        self.negative_cache = get_negative_cache()
+        self.index = get_media_index()
 
     def _get_tvmaze(self, endpoint, params={}):
         url = f"https://api.tvmaze.com/{endpoint}"
 
         if not self.session:
-            self._new_session()
+            self.session = get_session()
 
         headers = {
             "accept": "application/json",
         }
-        response = self.session.get(url, headers=headers, params=params)
-        raw_json = json.loads(response.text)
+        raw_json = get_json(
+            self.session, url, self.limiter, params=params, headers=headers
+        )
         return raw_json
 
-    def search_series(
+    def remaining(self) -> int | None:
+        """
+        Get the number of requests left today, or None if there is no daily limit.
+
+        There is no limit in offline mode because no requests are sent.
+        """
+        if is_offline():
+            return None
+        return self.limiter.remaining()
+
+    def is_known_empty(self, name: str, year: int = None, kind: str = "series") -> bool:
+        """Check if a search is known to have no results, without sending any requests."""
+        return self.negative_cache.is_empty(self.source, kind, name, year)
+
+    def _set_empty(self, name: str, year: int = None, kind: str = "series") -> None:
+        """Remember that a search had no results. Offline cache misses are not remembered."""
+        if not is_offline():
+            self.negative_cache.add(
+                self.source, kind, name, year, ttl=self.negative_ttl
+            )
+
+    def search_series_stubs(
         self, name: str, year: int = None, limit: int = 5
     ) -> list[Series]:
+        """Search for series using only the search results, without seasons or episodes."""
+        if self.is_known_empty(name, year, "series"):
+            return []
+
         params = {"q": name}
         all_series = self._get_tvmaze("search/shows", params=params)
         if not all_series:
+            self._set_empty(name, year, "series")
             return []
         elif len(all_series) > limit:
             all_series = all_series[0:limit]
-        return self._process_series(all_series)
+        results = [
+            self._process_show(Series(), result["show"]) for result in all_series
+        ]
+        self.index.add_all(results, replace=False)
+        return results
+
+    def search_series(
+        self, name: str, year: int = None, limit: int = 5
+    ) -> list[Series]:
+        stubs = self.search_series_stubs(name, year, limit)
+        return [self.hydrate(series) for series in stubs]
+
+    def search_movies_stubs(
+        self, name: str, year: int = None, limit: int = 5
+    ) -> list[Movie]:
+        """Placeholder to search for movies. This will always return an empty list as TV Maze does not support movies."""
+        return []
 
     def search_movies(self, name: str, year: int = None, limit: int = 5) -> list[Movie]:
         """Placeholder to search for movies. This will always return an empty list as TV Maze does not support movies."""
         return []
 
+    def hydrate(self, series: Series, on_progress=None) -> Series:
+        """
+        Fetch the seasons and episodes of a series stub.
+
+        The show information is refreshed from the same request.
+        on_progress is not used because everything arrives in a single request.
+        Finished results are kept in the object cache.
+        """
+        key = self.object_cache.make_key(self.source, "series", series.ids["tvmaze"])
+        cached = self.object_cache.get(key)
+        if cached:
+            return cached
+
+        s = self._get_series(series_id=series.ids["tvmaze"])
+        if not s:
+            return series
+
+        series = self._process_show(series, s)
+
+        # Process the embedded information for seasons
+        series = self._process_seasons(series, s)
+
+        # Process the embedded information for episodes
+        series = self._process_episodes(series, s)
+        series.build_index()
+
+        if series.is_valid():
+            # Series still airing get new episodes, so they are kept for less time
+            self.object_cache.set(key, series, ttl=get_expiration(series.status))
+            self.index.add(series)
+        return series
+
     def _process_externals(self, externals: dict[str, str | int]):
         """
         Process externals to extract relevant ids for other services like IMDb, TVDB, etc.
@@ -104,7 +174,7 @@ class MetadataDownloader:
             if "name" in network_info["country"]:
                 network.origin_country = network_info["country"]["name"]
 
-        return network
+        return Network.intern(network)
 
     def _process_html(self, html_content: str):
         if html_content:
@@ -144,6 +214,9 @@ class MetadataDownloader:
                 episode.type = e["type"]
             if "image" in e:
                 episode.still_path = self._process_image(e["image"])
+            if "airdate" in e:
+                if e["airdate"]:
+                    episode.air_date = e["airdate"]
 
             # Add the episode to the corresponding season
             # This assumes the season is already created within the series object
@@ -175,46 +248,32 @@ class MetadataDownloader:
 
         return series
 
-    def _process_series(self, all_series: list[dict]) -> list[Series]:
-        processed_results = []
-        for result in all_series:
-            series = Series()
-
-            # Process the main show information
-            series.source = "tvmaze"
-            s = result["show"]
-            if "id" in s:
-                series.ids["tvmaze"] = s["id"]
-                # Reset series with extra information in _embedded
-                s = self._get_series(series_id=series.ids["tvmaze"])
-            if "externals" in s:
-                series.ids.update(self._process_externals(s["externals"]))
-            if "name" in s:
-                series.name = s["name"]
-            if "summary" in s:
-                if s["summary"]:
-                    series.overview = self._process_html(s["summary"])
-            if "premiered" in s:
-                series.air_date = s["premiered"]
-                if series.air_date:
-                    series.year = int(series.air_date[0:4])
-            if "genres" in s:
-                series.genres = s["genres"]
-            if "network" in s:
-                network = s["network"]
-                if network:
-                    series.networks += [self._process_network(network)]
-            if "image" in s:
-                image = s["image"]
-                if image:
-                    series.poster_path = self._process_image(image)
-
-            # Process the embedded information for seasons
-            series = self._process_seasons(series, s)
-
-            # Process the embedded information for episodes
-            series = self._process_episodes(series, s)
-
-            processed_results += [series]
-
-        return processed_results
+    def _process_show(self, series: Series, s: dict) -> Series:
+        """Process the main show information."""
+        series.source = "tvmaze"
+        if "id" in s:
+            series.ids["tvmaze"] = s["id"]
+        if "externals" in s:
+            series.ids.update(self._process_externals(s["externals"]))
+        if "name" in s:
+            series.name = s["name"]
+        if "summary" in s:
+            if s["summary"]:
+                series.overview = self._process_html(s["summary"])
+        if "premiered" in s:
+            series.air_date = s["premiered"]
+            if series.air_date:
+                series.year = int(series.air_date[0:4])
+        if "status" in s:
+            series.status = s["status"] or ""
+        if "genres" in s:
+            series.genres = s["genres"]
+        if "network" in s:
+            network = s["network"]
+            if network:
+                series.networks = [self._process_network(network)]
+        if "image" in s:
+            image = s["image"]
+            if image:
+                series.poster_path = self._process_image(image)
+        return series
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QStringListModel
 from PyQt6.QtWidgets import (
+    QCompleter,
     QSizePolicy,
     QSpacerItem,
     QComboBox,
@@ -34,6 +35,12 @@ class MetadataPreview(QWidget):
         self.search_field.setToolTip("Series Query")
         self.search_field.setObjectName("SearchField")
 
+        self.search_suggestions = QStringListModel()
+        self.search_completer = QCompleter(self.search_suggestions, self.search_field)
+        self.search_completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.search_completer.setFilterMode(Qt.MatchFlag.MatchContains)
+        self.search_field.setCompleter(self.search_completer)
+
         self.search_button = QPushButton()
         self.search_button.setText("Search")
 
@@ -121,6 +128,15 @@ class MetadataPreview(QWidget):
     def clear_query(self):
         self.search_field.clear()
 
+    def set_suggestions(self, suggestions: list[str]):
+        """Replace the names suggested while typing a query"""
+        self.search_suggestions.setStringList(list(dict.fromkeys(suggestions)))
+
+    def add_suggestions(self, suggestions: list[str]):
+        """Add names to those suggested while typing a query"""
+        current = self.search_suggestions.stringList()
+        self.set_suggestions(current + suggestions)
+
 
 class SeriesMetadataPreview(MetadataPreview):
     """A widget to display series metadata."""
@@ -257,12 +273,6 @@ class SeriesMetadataPreview(MetadataPreview):
         """Get the displayed episode description"""
         return self.media_description_box.toPlainText().strip()
 
-    def select_next_episode(self):
-        """Select next episode after the selected episode in the episode list"""
-        next_row = self.episode_list.currentRow() + 1
-        if next_row < self.episode_list.count():
-            self.episode_list.setCurrentRow(next_row)
-
     def clear_seasons(self):
         """Clear the seasons combobox"""
         self.season_number_combobox.clear()
@@ -462,13 +472,6 @@ class SeriesMetadataPreview_old(QWidget):
         """Get the displayed episode description"""
         return self.episode_description_box.toPlainText().strip()
 
-    def select_next_episode(self):
-        """Select next episode after the selected episode in the episode list"""
-        current_row = self.episode_list.currentRow()
-        next_row = current_row + 1
-        if next_row < self.episode_list.count():
-            self.episode_list.setCurrentRow(next_row)
-
     def clear_seasons(self):
         """Clear the seasons combobox"""
         self.season_number_combobox.clear()
@@ -42,6 +42,14 @@ class SelectionDialog(QDialog):
         self.list_widget.addItem(item)
         if not self.list_widget.selectedItems():
             self.list_widget.setCurrentRow(0)
+        self._adjust_dialog_width()
+
+    def set_searching(self, searching: bool) -> None:
+        """Show whether more items are still expected to arrive."""
+        if searching:
+            self.setWindowTitle("Selection Dialog (Searching...)")
+        else:
+            self.setWindowTitle("Selection Dialog")
 
     def get_selected_data(self):
         """Get the data of the selected item."""
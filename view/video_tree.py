@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 
+import sys
 from pathlib import Path
+from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QFileSystemModel
 from PyQt6.QtWidgets import (
     QPushButton,
@@ -9,13 +11,51 @@ from PyQt6.QtWidgets import (
     QWidget,
 )
 
+sys.path.append(Path(__file__).parent.parent.as_posix())
+from backend.probe import get_probe_cache
+
+
+class VideoModel(QFileSystemModel):
+    """
+    A file system model that shows the title, duration and tracks of videos as tooltips.
+
+    Only probes that are already cached are shown, so hovering never reads a file.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.probe_cache = get_probe_cache()
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.ToolTipRole and not self.isDir(index):
+            info = self.probe_cache.get(Path(self.filePath(index)))
+            if info:
+                return self._format_tooltip(info)
+        return super().data(index, role)
+
+    @staticmethod
+    def _format_tooltip(info) -> str:
+        lines = []
+        if info.title:
+            lines += [info.title]
+        if info.duration:
+            minutes, seconds = divmod(round(info.duration), 60)
+            hours, minutes = divmod(minutes, 60)
+            lines += [f"{hours}:{minutes:02}:{seconds:02}"]
+        for track in info.tracks:
+            line = f"#{track.number} {track.type} {track.codec} [{track.language}]"
+            if track.name:
+                line += f" {track.name}"
+            lines += [line]
+        return "\n".join(lines)
+
 
 class VideoTree(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
 
         self.local_root = Path("")
-        self.model = QFileSystemModel()
+        self.model = VideoModel()
         self.tree = QTreeView()
 
         self.model.setRootPath("")
@@ -43,6 +83,13 @@ class VideoTree(QWidget):
             index = self.model.index(root_path.as_posix())
             self.tree.setRootIndex(index)
 
+    def set_probe_progress(self, done: int, total: int):
+        """Show how many videos have been probed in the folder button"""
+        text = f"Folder: {self.local_root.name}"
+        if done < total:
+            text += f" (probing {done}/{total})"
+        self.set_root_button.setText(text)
+
     def refresh(self):
         """Refresh the Video Tree View"""
         self.model.setRootPath(self.local_root.as_posix())